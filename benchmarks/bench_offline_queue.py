@@ -0,0 +1,208 @@
+"""Benchmarks for the offline heartbeat queue and the sync path, run against a local mock API.
+
+    python benchmarks/bench_offline_queue.py --sizes 1000,10000,100000 --output bench.json
+
+Results are printed and written as JSON so runs can be compared over time.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timer_core import SYNC_MAX_DEFAULT, ApiClient, OfflineHeartbeatManager, build_heartbeat  # noqa: E402
+from mock_api import MockApiServer  # noqa: E402
+
+UI_TICK_SECONDS = 1 / 60
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the per-heartbeat log lines, which would otherwise dominate the timings"""
+    logger = logging.getLogger("neighborhood_timer")
+    disabled = logger.disabled
+    logger.disabled = True
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logger.disabled = disabled
+
+TRACE_MEMORY = False
+
+@contextlib.contextmanager
+def measure_memory(result, key):
+    """Record peak Python allocations for a phase; off by default because tracemalloc slows everything down"""
+    if not TRACE_MEMORY:
+        yield
+        return
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[key] = round(peak / 1024, 1)
+
+def fill(manager, count):
+    for i in range(count):
+        manager.save_heartbeat_offline(build_heartbeat(f"project-{i % 5}", "Python", "bench-key", 1_700_000_000 + i))
+    manager.flush(durable=True)
+
+def bench_enqueue(manager, count, result):
+    with measure_memory(result, "enqueue_peak_kib"), quiet():
+        started = time.perf_counter()
+        fill(manager, count)
+        elapsed = time.perf_counter() - started
+    result["enqueue_seconds"] = round(elapsed, 3)
+    result["enqueue_per_second"] = round(count / elapsed)
+    result["db_bytes"] = sum(
+        os.path.getsize(manager.db_path + suffix)
+        for suffix in ("", "-wal") if os.path.exists(manager.db_path + suffix)
+    )
+
+def bench_scan(manager, count, result):
+    """Stream the whole queue through the cursor API; peak memory should not grow with the queue"""
+    with measure_memory(result, "scan_peak_kib"), quiet():
+        started = time.perf_counter()
+        scanned = sum(1 for _ in manager.iter_heartbeats())
+        elapsed = time.perf_counter() - started
+    result["scan_seconds"] = round(elapsed, 3)
+    result["scan_per_second"] = round(scanned / elapsed) if elapsed else None
+
+def bench_dequeue(manager, count, result):
+    with measure_memory(result, "dequeue_peak_kib"), quiet():
+        started = time.perf_counter()
+        removed = 0
+        while True:
+            batch = manager.get_offline_heartbeats(SYNC_MAX_DEFAULT)
+            if not batch:
+                break
+            removed += manager.remove_heartbeats(record.key for record in batch)
+        elapsed = time.perf_counter() - started
+    result["dequeue_seconds"] = round(elapsed, 3)
+    result["dequeue_per_second"] = round(removed / elapsed) if elapsed else None
+
+def watch_ui_thread(worker):
+    """Tick like a 60 fps Kivy Clock while worker runs; return how late the ticks were (ms)"""
+    lateness = []
+    next_tick = time.perf_counter() + UI_TICK_SECONDS
+    while worker.is_alive():
+        time.sleep(max(0, next_tick - time.perf_counter()))
+        now = time.perf_counter()
+        lateness.append((now - next_tick) * 1000)
+        next_tick = now + UI_TICK_SECONDS
+    if not lateness:
+        return {"ui_tick_max_ms": 0, "ui_tick_p99_ms": 0}
+    lateness.sort()
+    return {
+        "ui_tick_max_ms": round(lateness[-1], 2),
+        "ui_tick_p99_ms": round(lateness[int(len(lateness) * 0.99) - 1 if len(lateness) > 1 else 0], 2),
+        "ui_tick_mean_ms": round(statistics.mean(lateness), 3),
+    }
+
+def bench_sync(manager, count, server, result, max_rounds):
+    with quiet():
+        fill(manager, count)
+    manager.api = ApiClient(base_url=server.url, backoff_base=0.01, backoff_cap=0.1)
+    requests_before = server.requests
+    state = {"synced": 0, "rounds": 0}
+    
+    def drain():
+        with quiet():
+            while state["rounds"] < max_rounds and manager.count_offline_heartbeats():
+                state["synced"] += manager.sync_offline_heartbeats("bench-key", force=True)
+                state["rounds"] += 1
+    
+    worker = threading.Thread(target=drain, name="bench-sync")
+    with measure_memory(result, "sync_peak_kib"):
+        started = time.perf_counter()
+        worker.start()
+        result.update(watch_ui_thread(worker))
+        worker.join()
+        elapsed = time.perf_counter() - started
+    result["sync_seconds"] = round(elapsed, 3)
+    result["sync_per_second"] = round(state["synced"] / elapsed) if elapsed else None
+    result["sync_http_requests"] = server.requests - requests_before
+    result["sync_left_queued"] = manager.count_offline_heartbeats()
+    result["http"] = manager.api.stats()
+    manager.api.close()
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {
+        "config": {
+            "sizes": sizes,
+            "latency_ms": args.latency_ms,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "bulk": not args.no_bulk,
+            "durability": args.durability,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": {},
+    }
+    server = MockApiServer(
+        latency=args.latency_ms / 1000, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, bulk=not args.no_bulk
+    )
+    with server, tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            result = {}
+            manager = OfflineHeartbeatManager(os.path.join(workdir, f"queue-{size}.db"), durability=args.durability)
+            bench_enqueue(manager, size, result)
+            bench_scan(manager, size, result)
+            bench_dequeue(manager, size, result)
+            if size <= args.max_sync_size:
+                bench_sync(manager, size, server, result, args.max_sync_rounds)
+            manager.close()
+            manager.conn.close()
+            report["results"][str(size)] = result
+            print(f"{size:>7} heartbeats: {json.dumps(result)}")
+    report["max_rss_kib"] = max_rss_kib()
+    return report
+
+def max_rss_kib():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated queue sizes")
+    parser.add_argument("--latency-ms", type=float, default=20, help="mock API latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests/items answered 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument("--no-bulk", action="store_true", help="make the mock reject the bulk endpoint")
+    parser.add_argument("--durability", default="normal", choices=("off", "normal", "full"),
+                        help="fsync policy for the offline queue")
+    parser.add_argument("--max-sync-size", type=int, default=10000, help="skip the sync benchmark above this size")
+    parser.add_argument("--max-sync-rounds", type=int, default=200, help="give up draining after this many rounds")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record per-phase peak allocations with tracemalloc (inflates timings)")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    global TRACE_MEMORY
+    TRACE_MEMORY = args.trace_memory
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
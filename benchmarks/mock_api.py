@@ -0,0 +1,119 @@
+"""Local stand-in for the Adventure Time API heartbeat endpoints, for benchmarks"""
+import json
+from collections import Counter
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockApiServer:
+    """Serves /api/heartbeats and /api/heartbeats/bulk on localhost with configurable latency and failures"""
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, bulk=True, seed=0, reject=None, keys=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.bulk = bulk
+        self.reject = reject  # heartbeat -> True to answer it 400, as the API does for a malformed one
+        self.keys = keys  # API keys to accept (any when None); a request with another one gets 401
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.heartbeats_accepted = 0
+        self.received = Counter()  # entity -> times accepted, to spot lost or duplicated heartbeats
+        self.received_keys = Counter()  # API key -> heartbeats accepted with it
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+    
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api"
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-api", daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+    
+    def _roll(self):
+        """Pick this request's fate: 429, 500 or success"""
+        with self.lock:
+            self.requests += 1
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return 202
+    
+    def _accept(self, heartbeats):
+        with self.lock:
+            self.heartbeats_accepted += len(heartbeats)
+            self.received.update(heartbeat.get("entity") for heartbeat in heartbeats)
+            self.received_keys.update(heartbeat.get("hackatimeToken") for heartbeat in heartbeats)
+    
+    def _authorized(self, heartbeats):
+        return self.keys is None or all(heartbeat.get("hackatimeToken") in self.keys for heartbeat in heartbeats)
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+            # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per request
+            disable_nagle_algorithm = True
+            
+            def log_message(self, *args):
+                pass
+            
+            def reply(self, status, body=None, headers=()):
+                data = json.dumps(body if body is not None else {}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+                if server.latency:
+                    time.sleep(server.latency)
+                if self.path == "/api/heartbeats/bulk":
+                    if not server.bulk:
+                        self.reply(404, {"message": "Not found"})
+                        return
+                    status = server._roll() if server._authorized(body) else 401
+                    if status != 202:
+                        self.reply(status, headers=[("Retry-After", "0")] if status == 429 else ())
+                        return
+                    # Per-item results, failing individual heartbeats at the configured error rate
+                    results = []
+                    for heartbeat in body:
+                        item_status = 201 if server.random.random() >= server.error_rate else 500
+                        if server.reject and server.reject(heartbeat):
+                            item_status = 400
+                        results.append([{}, item_status])
+                    server._accept([heartbeat for heartbeat, (_, item_status) in zip(body, results) if item_status == 201])
+                    self.reply(202, {"responses": results})
+                elif self.path == "/api/heartbeats":
+                    status = server._roll() if server._authorized([body]) else 401
+                    if status == 202 and server.reject and server.reject(body):
+                        status = 400
+                    if status == 202:
+                        server._accept([body])
+                    self.reply(status, headers=[("Retry-After", "0")] if status == 429 else ())
+                else:
+                    self.reply(404, {"message": "Not found"})
+        
+        return Handler
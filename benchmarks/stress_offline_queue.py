@@ -0,0 +1,114 @@
+"""Stress test for several processes sharing one offline heartbeat queue, against a local mock API.
+
+    python benchmarks/stress_offline_queue.py --writers 4 --syncers 2 --heartbeats 2000
+
+Writer processes queue uniquely named heartbeats while syncer processes drain the same database.
+Once everything is synced, every heartbeat must have reached the mock API exactly once; the
+exit status is 1 if any was lost or sent twice.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timer_core import ApiClient, OfflineHeartbeatManager, build_heartbeat  # noqa: E402
+from mock_api import MockApiServer  # noqa: E402
+
+def entity(writer, index):
+    return f"writer-{writer}/{index}"
+
+def write(db_path, writer, count, durability):
+    logging.getLogger("neighborhood_timer").disabled = True
+    rng = random.Random(writer)
+    # Small, uneven buffers so the writers' transactions interleave
+    manager = OfflineHeartbeatManager(db_path, flush_size=rng.randint(1, 20), durability=durability)
+    for index in range(count):
+        heartbeat = build_heartbeat(f"project-{index % 3}", "Python", "stress-key", 1_700_000_000 + index)
+        heartbeat["entity"] = entity(writer, index)
+        manager.save_heartbeat_offline(heartbeat)
+        if rng.random() < 0.01:
+            time.sleep(rng.random() / 100)
+    manager.close()
+
+def sync(db_path, api_url, stop):
+    logging.getLogger("neighborhood_timer").disabled = True
+    manager = OfflineHeartbeatManager(db_path)
+    manager.api = ApiClient(base_url=api_url)
+    while not stop.is_set():
+        if not manager.sync_offline_heartbeats("stress-key", force=True):
+            time.sleep(0.01)
+    manager.close()
+
+def run(args):
+    context = multiprocessing.get_context("spawn")
+    with MockApiServer(latency=args.latency_ms / 1000) as server, tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "queue.db")
+        stop = context.Event()
+        syncers = [context.Process(target=sync, args=(db_path, server.url, stop)) for _ in range(args.syncers)]
+        writers = [
+            context.Process(target=write, args=(db_path, writer, args.heartbeats, args.durability))
+            for writer in range(args.writers)
+        ]
+        started = time.perf_counter()
+        for process in syncers + writers:
+            process.start()
+        for process in writers:
+            process.join()
+        stop.set()
+        for process in syncers:
+            process.join()
+        failed = [process.exitcode for process in syncers + writers if process.exitcode]
+
+        # Whatever the syncers did not get to
+        logging.getLogger("neighborhood_timer").disabled = True
+        manager = OfflineHeartbeatManager(db_path)
+        manager.api = ApiClient(base_url=server.url)
+        while manager.sync_offline_heartbeats("stress-key", force=True):
+            pass
+        remaining = manager.count_offline_heartbeats()
+        manager.close()
+        elapsed = time.perf_counter() - started
+
+        expected = {entity(writer, index) for writer in range(args.writers) for index in range(args.heartbeats)}
+        received = server.received
+    lost = sorted(expected - set(received))
+    duplicated = sorted(name for name, times in received.items() if times > 1)
+    return {
+        "writers": args.writers,
+        "syncers": args.syncers,
+        "heartbeats": len(expected),
+        "received": sum(received.values()),
+        "lost": len(lost),
+        "duplicated": len(duplicated),
+        "unexpected": len(set(received) - expected),
+        "left_in_queue": remaining,
+        "failed_processes": len(failed),
+        "seconds": round(elapsed, 2),
+        "examples": {"lost": lost[:5], "duplicated": duplicated[:5]},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4, help="processes queueing heartbeats")
+    parser.add_argument("--syncers", type=int, default=2, help="processes syncing the queue while it fills")
+    parser.add_argument("--heartbeats", type=int, default=2000, help="heartbeats queued by each writer")
+    parser.add_argument("--latency-ms", type=float, default=2, help="mock API latency per request")
+    parser.add_argument("--durability", default="normal", choices=("off", "normal", "full"),
+                        help="fsync policy for the writers")
+    args = parser.parse_args(argv)
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    ok = not (report["lost"] or report["duplicated"] or report["unexpected"]
+              or report["left_in_queue"] or report["failed_processes"])
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
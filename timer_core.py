@@ -0,0 +1,2389 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+from collections import OrderedDict, deque
+import json
+import hashlib
+import contextlib
+import base64
+import random
+import sqlite3
+import logging
+
+API_BASE = "https://adventure-time.hackclub.dev/api"
+TOKEN_FILE = "auth_token.txt"
+HACKATIME_KEY_FILE = "hackatime_api_key.txt"
+OFFLINE_HEARTBEATS_DB = "offline_heartbeats.db"
+SYNC_MAX_DEFAULT = 1000
+SEND_LIMIT = 25
+RATE_LIMIT_SECONDS = 120
+# Offline saves are buffered and written in groups: whichever of these comes first
+OFFLINE_FLUSH_SIZE = 50
+OFFLINE_FLUSH_SECONDS = 2
+# How hard each write is pushed to disk: "off" never fsyncs, "normal" fsyncs the WAL at
+# checkpoints and on durable flushes, "full" fsyncs every flush
+OFFLINE_DURABILITY = "normal"
+HEARTBEATS_BULK_PATH = "heartbeats/bulk"
+SYNC_PIPELINE_WORKERS = 4
+REQUEST_WORKERS = 4
+TIMER_RENDER_INTERVAL = 0.5
+REQUEST_TIMEOUT = 10
+MAX_RETRIES = 3
+HEARTBEAT_INTERVAL = 10
+# One heartbeat per minute per entity is plenty: Hackatime bridges gaps up to its 2 minute timeout
+HEARTBEAT_COALESCE_SECONDS = 60
+HEARTBEAT_BACKOFF_CAP = 300
+IDLE_POLL_SECONDS = 5
+METADATA_CACHE_FILE = "metadata_cache.json"
+SETTINGS_FILE = "settings.json"
+TIME_LEDGER_DB = "time_ledger.db"
+# Like Hackatime's timeout: the gap since the previous heartbeat counts as time only up to this
+HEARTBEAT_GAP_CAP = 120
+SETTINGS_SAVE_DELAY = 1.0  # quiet period before edits are written, so typing a key costs one write
+SETTINGS_RETRY_CAP = 60  # longest wait between attempts while the settings file cannot be written
+APPS_CACHE_TTL = 60
+PROJECTS_CACHE_TTL = 600
+IMAGE_CACHE_DIR = "image_cache"
+IMAGE_CACHE_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_CHUNK_SIZE = 64 * 1024
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+ACCEPTED_STATUSES = (200, 201, 202)
+BULK_UNSUPPORTED_STATUSES = (404, 405, 501)
+AUTH_FAILED_STATUSES = (401, 403)
+NO_PROJECT = ""  # stored in place of a heartbeat's missing project; the field stays absent when it is sent
+GATEWAY_BATCH_SECONDS = 5  # longest the local gateway waits to start a sync for the editor heartbeats it queued
+GATEWAY_MAX_BODY = 1024 * 1024
+GATEWAY_DEDUP_SIZE = 10000
+LOG_RATE_LIMIT = 20  # messages per event per window before the rest are only counted
+LOG_RATE_WINDOW = 60
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+UI_STALL_SECONDS = 0.25
+
+class EventLogger:
+    """Leveled, structured logging: an event name plus key=value fields, rate limited per event"""
+    def __init__(self, name, rate_limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        self.logger = logging.getLogger(name)
+        self.rate_limit = rate_limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.windows = {}  # event -> [window start, emitted, suppressed]
+    
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, fields)
+    
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, fields)
+    
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, fields)
+    
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, fields)
+    
+    def log(self, level, event, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        suppressed = 0
+        with self.lock:
+            state = self.windows.setdefault(event, [now, 0, 0])
+            if now - state[0] >= self.window:
+                suppressed = state[2]
+                state[:] = [now, 0, 0]
+            if state[1] >= self.rate_limit:
+                state[2] += 1
+                return
+            state[1] += 1
+        if suppressed:
+            self._emit(logging.WARNING, "log.suppressed", {"event": event, "count": suppressed})
+        self._emit(level, event, fields)
+    
+    def _emit(self, level, event, fields):
+        message = " ".join([event] + [f"{key}={value!r}" for key, value in fields.items()])
+        self.logger.log(level, message, extra={"event": event, "fields": fields})
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "event": getattr(record, "event", None)}
+        entry.update({key: str(value) for key, value in getattr(record, "fields", {}).items()})
+        if entry["event"] is None:
+            entry["message"] = record.getMessage()
+        return json.dumps(entry)
+
+def configure_logging(level="INFO", json_output=False):
+    """Send our log events to stderr; kept apart from Kivy's handlers on the root logger"""
+    handler = logging.StreamHandler()
+    if json_output:
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    root = logging.getLogger("neighborhood_timer")
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
+
+log = EventLogger("neighborhood_timer")
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+class Metrics:
+    """In-process counters, gauges and histograms, exported as JSON or Prometheus text"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.gauge_callbacks = {}
+        self.histograms = {}
+    
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+    
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+    
+    def gauge_callback(self, name, callback):
+        """Compute a gauge only when metrics are read, e.g. a queue depth that costs a query"""
+        with self.lock:
+            self.gauge_callbacks[name] = callback
+    
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+    
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            callbacks = dict(self.gauge_callbacks)
+            histograms = {
+                key: (h.buckets, list(h.counts), h.total, h.count) for key, h in self.histograms.items()
+            }
+        for name, callback in callbacks.items():
+            try:
+                gauges[(name, ())] = callback()
+            except Exception as e:
+                log.warning("metrics.gauge_failed", gauge=name, error=str(e))
+        return counters, gauges, histograms
+    
+    def to_json(self):
+        counters, gauges, histograms = self.snapshot()
+        
+        def label_name(name, labels):
+            return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+        
+        return {
+            "counters": {label_name(*key): value for key, value in counters.items()},
+            "gauges": {label_name(*key): value for key, value in gauges.items()},
+            "histograms": {
+                label_name(*key): {
+                    "buckets": dict(zip([str(b) for b in buckets] + ["+Inf"], counts)),
+                    "sum": round(total, 6),
+                    "count": count,
+                }
+                for key, (buckets, counts, total, count) in histograms.items()
+            },
+        }
+    
+    def to_prometheus(self):
+        counters, gauges, histograms = self.snapshot()
+        
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+        
+        lines = []
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f"# TYPE neighborhood_timer_{name} {kind}")
+                for (series_name, labels), value in series.items():
+                    if series_name == name:
+                        lines.append(f"neighborhood_timer_{name}{labels_text(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE neighborhood_timer_{name} histogram")
+            for (series_name, labels), (buckets, counts, total, count) in histograms.items():
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append(f"neighborhood_timer_{name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"neighborhood_timer_{name}_sum{labels_text(labels)} {total}")
+                lines.append(f"neighborhood_timer_{name}_count{labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json on localhost from a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.to_prometheus().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.to_json()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    log.info("metrics.serving", url=f"http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+class StartupProfiler:
+    """Records how long after launch each startup stage first completed"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.imports = {}
+        self.report_path = None  # set to write a JSON report as stages complete
+    
+    def mark(self, stage):
+        if stage in self.stages:
+            return
+        self.stages[stage] = (time.perf_counter() - self.started) * 1000
+        log.info("startup.stage", stage=stage, ms=round(self.stages[stage]))
+        if self.report_path:
+            self.write_report(self.report_path)
+    
+    def record_import(self, module, started):
+        self.imports.setdefault(module, (time.perf_counter() - started) * 1000)
+    
+    def report(self):
+        return {"stages_ms": dict(self.stages), "imports_ms": dict(self.imports)}
+    
+    def write_report(self, path):
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+        except OSError as e:
+            log.error("startup.report_failed", path=path, error=str(e))
+
+startup_profiler = StartupProfiler()
+
+def import_requests():
+    """Import requests on first use; it is one of the slowest imports at startup"""
+    started = time.perf_counter()
+    import requests
+    startup_profiler.record_import("requests", started)
+    return requests
+
+@contextlib.contextmanager
+def immediate_transaction(conn):
+    """A write transaction that takes the database's write lock up front
+    
+    Other processes may share the database. A deferred transaction that reads before it writes
+    fails straight away with "database is locked" if one of them commits in between; BEGIN
+    IMMEDIATE waits out the connection's busy timeout for the lock instead.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+class FileLock:
+    """Advisory lock on a file, shared with every process that opens the same path
+    
+    The OS drops it if the holder exits or crashes, so a stale lock never blocks anyone. Each
+    acquire opens its own handle, so threads of one process exclude each other too.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+    
+    def acquire(self, blocking=True):
+        """Take the lock; with blocking=False returns False at once if someone else holds it"""
+        handle = open(self.path, "a+b")
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            handle.close()
+            if blocking:
+                raise
+            return False
+        self.handle = handle
+        return True
+    
+    def release(self):
+        handle, self.handle = self.handle, None
+        if handle is None:
+            return
+        if sys.platform == "win32":
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        handle.close()  # closing also releases a flock
+
+def call_on_main_thread(callback):
+    """Default result dispatcher: run callback on the Kivy main thread"""
+    from kivy.clock import Clock
+    Clock.schedule_once(lambda dt: callback())
+
+class ApiClient:
+    """Shared keep-alive session for the Adventure Time API with timeouts and retry backoff"""
+    def __init__(self, base_url=API_BASE, timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_base=0.5, backoff_cap=8):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.adapter = None
+        self._session = None
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.retry_count = 0
+    
+    @property
+    def session(self):
+        """The pooled session, created (and requests imported) on first use rather than at startup"""
+        with self.lock:
+            if self._session is None:
+                requests = import_requests()
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                # Enough pooled connections for the request workers plus a pipelined sync
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=REQUEST_WORKERS + SYNC_PIPELINE_WORKERS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.adapter = adapter
+                self._session = session
+            return self._session
+    
+    def url(self, path):
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+    
+    def request(self, method, path, retries=None, **kwargs):
+        """Send a request, retrying connection errors and 429/5xx with jittered exponential backoff"""
+        kwargs.setdefault("timeout", self.timeout)
+        retries = self.max_retries if retries is None else retries
+        url = self.url(path)
+        session = self.session
+        requests = import_requests()
+        attempt = 0
+        while True:
+            with self.lock:
+                self.request_count += 1
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.inc("http_requests_total", status="error")
+                if attempt >= retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                metrics.observe("http_request_seconds", time.monotonic() - started)
+                metrics.inc("http_requests_total", status=response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                response.close()
+            with self.lock:
+                self.retry_count += 1
+            metrics.inc("http_retries_total")
+            time.sleep(delay)
+            attempt += 1
+    
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_cap)
+        # "Full jitter": spread concurrent retries over the whole window
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+    
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+    
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+    
+    def stats(self):
+        """Return request, retry and new-connection counts for the pooled session"""
+        connections = 0
+        if self.adapter is not None:
+            pools = self.adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    connections += pool.num_connections
+        with self.lock:
+            requests_sent = self.request_count
+            retries = self.retry_count
+        reused = max(requests_sent - connections, 0)
+        return {
+            "requests": requests_sent,
+            "retries": retries,
+            "connections_opened": connections,
+            "reuse_ratio": reused / requests_sent if requests_sent else 0,
+        }
+    
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+api_client = ApiClient()
+
+def key_owner(api_key):
+    """Stable stand-in for an API key, stored with heartbeats queued for a key other than the app's own"""
+    return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+
+class HeartbeatRecord:
+    """A queued heartbeat as stored: interned labels, no API token, and only the fields that differ from usual"""
+    __slots__ = ("key", "time", "project", "language", "entity", "extra", "owner")
+    
+    # Fields every heartbeat from build_heartbeat() carries with these values; they are not stored
+    DEFAULTS = {"type": "file", "is_write": True}
+    
+    def __init__(self, key, time, project, language=None, entity=None, extra=None, owner=None):
+        self.key = key
+        self.time = time
+        self.project = project
+        self.language = language
+        self.entity = entity  # None when it is the project name, as for the app's own heartbeats
+        self.extra = extra
+        self.owner = owner  # key_owner() of the plugin key it must be sent with; None for the app's key
+    
+    @classmethod
+    def from_payload(cls, payload, key=None):
+        fields = dict(payload)
+        fields.pop("hackatimeToken", None)  # injected again at send time, never written to disk
+        timestamp = fields.pop("time", None)
+        project = fields.pop("project", None) or NO_PROJECT
+        language = fields.pop("language", None)
+        entity = fields.pop("entity", None)
+        extra = {
+            name: value for name, value in fields.items()
+            if name not in cls.DEFAULTS or cls.DEFAULTS[name] != value
+        }
+        for name in cls.DEFAULTS:
+            if name not in fields:
+                extra[name] = None  # absent in the original, so leave it out when sending
+        return cls(
+            key, int(time.time()) if timestamp is None else timestamp, project, language,
+            None if entity == project else entity, extra or None
+        )
+    
+    def to_payload(self, api_key):
+        payload = {
+            "entity": self.entity or self.project or None,
+            "time": self.time,
+            "project": self.project or None,
+            "language": self.language,
+            "hackatimeToken": api_key,
+        }
+        payload.update(self.DEFAULTS)
+        if self.extra:
+            payload.update(self.extra)
+        return {name: value for name, value in payload.items() if value is not None}
+
+class OfflineHeartbeatManager:
+    def __init__(self, db_path=OFFLINE_HEARTBEATS_DB, flush_size=OFFLINE_FLUSH_SIZE,
+                 flush_interval=OFFLINE_FLUSH_SECONDS, durability=OFFLINE_DURABILITY):
+        if durability not in ("off", "normal", "full"):
+            raise ValueError(f"Unknown durability policy: {durability}")
+        self.db_path = db_path
+        self.legacy_json_path = db_path.replace('.db', '.json')
+        self.last_sync_time = 0
+        self.lock = threading.RLock()
+        self._conn = None
+        # Write-behind buffer: saves land here and a background thread writes them in groups
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.buffer = []
+        self.buffer_lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.flusher = None
+        self.closed = False
+        self.label_ids = {}  # project/language string -> labels row id, committed ones only
+        self.label_values = {}  # and back, with the strings interned so records share them
+        self.new_labels = {}  # labels added by the open transaction, cached once it commits
+        self.stored = 0  # rows in the queue as last seen by this process, for depth()
+        # key_owner() -> API key, for heartbeats queued on behalf of gateway plugins. Kept in memory only,
+        # like every other token: after a restart their rows wait until the plugin sends again
+        self.keys = {}
+        self.bulk_supported = None  # unknown until the bulk endpoint has answered once
+        self.api = api_client
+        self.ledger = None  # a TimeLedger to tell when queued heartbeats are synced or dropped
+        self.sync_lock = FileLock(db_path + ".sync.lock")
+    
+    @property
+    def conn(self):
+        """SQLite connection, opened on first use so creating the manager costs no disk I/O"""
+        if self._conn is None:
+            with self.lock:
+                if self._conn is None:
+                    self.init_database()
+        return self._conn
+    
+    def init_database(self):
+        """Initialize the SQLite database for offline heartbeats"""
+        try:
+            # WAL keeps readers off the writer's back and makes every commit
+            # crash-safe, unlike rewriting the whole JSON file on each change
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.durability.upper()}")
+            # Each row is a few integers: project and language strings live once in labels (never deleted,
+            # so cached ids stay valid in every process), and the key is the row id
+            conn.execute("CREATE TABLE IF NOT EXISTS labels (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS queue ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " time NUMERIC NOT NULL,"
+                " project INTEGER NOT NULL,"
+                " language INTEGER,"
+                " entity INTEGER,"  # a label id in rows from older versions; entities now live in extra
+                " extra TEXT,"
+                " owner INTEGER)"  # label id of the key_owner() to send with; NULL for the app's key
+            )
+            if "owner" not in [column[1] for column in conn.execute("PRAGMA table_info(queue)")]:
+                conn.execute("ALTER TABLE queue ADD COLUMN owner INTEGER")
+            # Project filters only come from the unsynced viewer; scanning rows this small is cheap
+            # enough that a second index isn't worth its space on every queued heartbeat
+            conn.execute("CREATE INDEX IF NOT EXISTS queue_time ON queue (time)")
+            conn.commit()
+            self._conn = conn
+            self._migrate_payload_table()
+            self._migrate_legacy_json()
+            self.stored = conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+        except Exception as e:
+            log.error("offline.init_failed", error=str(e))
+    
+    def _migrate_payload_table(self):
+        """Convert rows from the earlier one-JSON-payload-per-row table, once"""
+        with self._write():
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'heartbeats'"
+            ).fetchone()
+            if not exists:
+                return
+            rows = self.conn.execute("SELECT payload FROM heartbeats ORDER BY time, id")
+            count = self._insert_records(HeartbeatRecord.from_payload(json.loads(payload)) for payload, in rows)
+            self.conn.execute("DROP TABLE heartbeats")
+        # Rewrite the file so the dropped rows, API tokens included, don't linger in free pages
+        self.conn.execute("VACUUM")
+        log.info("offline.migrated", count=count, path=self.db_path)
+    
+    def _migrate_legacy_json(self):
+        """Import heartbeats queued by the old JSON file store, once"""
+        if not os.path.exists(self.legacy_json_path):
+            return
+        # Under the write lock, so two instances starting together import the file only once
+        with self._write():
+            if not os.path.exists(self.legacy_json_path):
+                return  # another process imported it while this one waited
+            try:
+                with open(self.legacy_json_path, 'r') as f:
+                    legacy = json.load(f).get("heartbeats", {})
+            except (OSError, ValueError, AttributeError) as e:
+                log.warning("offline.legacy_unreadable", path=self.legacy_json_path, error=str(e))
+                legacy = {}
+            records = sorted(
+                (HeartbeatRecord.from_payload(hb) for hb in legacy.values() if isinstance(hb, dict)),
+                key=lambda record: record.time
+            )
+            count = self._insert_records(records)
+            os.replace(self.legacy_json_path, self.legacy_json_path + '.migrated')
+        log.info("offline.migrated", count=count, path=self.legacy_json_path)
+    
+    @contextlib.contextmanager
+    def _write(self):
+        """A write transaction on the queue; labels it adds are only cached once it has committed
+        
+        A rolled-back label's id may be handed to a different string later, so caching it early
+        would silently relabel heartbeats.
+        """
+        with self.lock:
+            try:
+                with immediate_transaction(self.conn):
+                    yield
+            except BaseException:
+                self.new_labels.clear()
+                raise
+            for value, label_id in self.new_labels.items():
+                self.label_ids[value] = label_id
+                self.label_values[label_id] = sys.intern(value)
+            self.new_labels.clear()
+    
+    def _label_id(self, value):
+        """Row id for a label string, adding it on first sight (call inside _write)"""
+        if value is None:
+            return None
+        label_id = self.label_ids.get(value) or self.new_labels.get(value)
+        if label_id is None:
+            self.conn.execute("INSERT OR IGNORE INTO labels (value) VALUES (?)", (value,))
+            label_id = self.conn.execute("SELECT id FROM labels WHERE value = ?", (value,)).fetchone()[0]
+            self.new_labels[value] = label_id
+        return label_id
+    
+    def _label_value(self, label_id):
+        if label_id is None:
+            return None
+        value = self.label_values.get(label_id)
+        if value is None:
+            # Added by another process sharing the database
+            with self.lock:
+                row = self.conn.execute("SELECT value FROM labels WHERE id = ?", (label_id,)).fetchone()
+            if row is None:
+                return "unknown"  # not cached: the id may yet be committed with its real value
+            value = self.label_values[label_id] = sys.intern(row[0])
+        return value
+    
+    def _insert_records(self, records):
+        """Insert records (call inside a transaction), setting each one's key; returns how many were added"""
+        count = 0
+        for record in records:
+            extra = record.extra
+            if record.entity is not None:
+                # Entities are mostly distinct file paths from editor plugins: interning them would grow
+                # labels (and its caches) forever, so they stay inline with the row
+                extra = dict(extra or (), entity=record.entity)
+            cursor = self.conn.execute(
+                "INSERT INTO queue (time, project, language, extra, owner) VALUES (?, ?, ?, ?, ?)",
+                (record.time, self._label_id(record.project), self._label_id(record.language),
+                 json.dumps(extra, separators=(',', ':')) if extra else None, self._label_id(record.owner))
+            )
+            record.key = str(cursor.lastrowid)
+            count += 1
+        return count
+    
+    def _record(self, row):
+        row_id, timestamp, project, language, entity, extra, owner = row
+        extra = json.loads(extra) if extra else None
+        if entity is not None:
+            entity = self._label_value(entity)  # rows queued while entities were still interned
+        elif extra and "entity" in extra:
+            entity = extra.pop("entity")
+        return HeartbeatRecord(
+            str(row_id), timestamp, self._label_value(project), self._label_value(language), entity, extra or None,
+            self._label_value(owner)
+        )
+    
+    def remember_key(self, api_key):
+        """Make api_key available to sync the heartbeats queued for it; returns its key_owner()"""
+        owner = key_owner(api_key)
+        self.keys[owner] = api_key
+        return owner
+    
+    def save_heartbeat_offline(self, heartbeat_data, owner_key=None):
+        """Save a heartbeat to offline storage (buffered; see flush)
+        
+        owner_key is the API key a gateway plugin sent it with; it is then only ever synced with that key.
+        """
+        try:
+            record = HeartbeatRecord.from_payload(heartbeat_data)
+        except Exception as e:
+            log.error("offline.save_failed", error=str(e))
+            return False
+        if owner_key:
+            record.owner = self.remember_key(owner_key)
+        with self.buffer_lock:
+            self.buffer.append(record)
+            buffered = len(self.buffer)
+        metrics.inc("offline_saved_total")
+        if self.closed:
+            self.flush()  # nothing left to flush in the background
+            return True
+        if self.flusher is None:
+            self._start_flusher()
+        if buffered >= self.flush_size:
+            self.flush_event.set()
+        return True
+    
+    def _start_flusher(self):
+        with self.buffer_lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self._flush_loop, name="offline-flush", daemon=True)
+        self.flusher.start()
+    
+    def _flush_loop(self):
+        while not self.closed:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            self.flush()
+    
+    def flush(self, durable=False):
+        """Write buffered heartbeats in one transaction, returning how many were written
+        
+        durable also fsyncs the write-ahead log (unless the policy is "off"), so what has been
+        saved survives a power cut, not just a crash of the app.
+        """
+        with self.buffer_lock:
+            records, self.buffer = self.buffer, []
+        if not records and not durable:
+            return 0
+        try:
+            with self.lock:
+                if records:
+                    with self._write():
+                        self._insert_records(records)
+                    self.stored += len(records)
+                if durable and self.durability == "normal":
+                    # A checkpoint syncs the WAL before copying it back into the database
+                    self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except Exception as e:
+            log.error("offline.flush_failed", count=len(records), error=str(e))
+            with self.buffer_lock:
+                self.buffer[:0] = records  # retried on the next flush
+            return 0
+        # Approximate: the time and up to three small label ids, plus any extra JSON
+        metrics.inc("offline_write_bytes_total", sum(
+            16 + (len(json.dumps(record.extra)) if record.extra else 0) for record in records
+        ))
+        if records:
+            metrics.inc("offline_flushes_total")
+            log.debug("offline.flushed", count=len(records), durable=durable)
+        return len(records)
+    
+    def close(self):
+        """Stop the background flusher and write everything still buffered durably"""
+        self.closed = True
+        self.flush_event.set()
+        if self.flusher is not None:
+            self.flusher.join(timeout=5)
+        self.flush(durable=True)
+    
+    def get_offline_heartbeats(self, limit=SYNC_MAX_DEFAULT):
+        """Get the oldest heartbeats from offline storage, for sending"""
+        self.flush()
+        return self.read_heartbeats(limit=limit)[0]
+    
+    def remove_heartbeat(self, key):
+        """Drop one queued heartbeat without syncing it (the viewer's delete button)"""
+        groups = self._queued_groups(" WHERE id = ?", [int(key)])
+        if self.remove_heartbeats([key]):
+            if self.ledger:
+                self.ledger.record_discarded(groups)
+            log.debug("offline.removed", key=key)
+    
+    def _queued_groups(self, where, params):
+        """(local day, project, count) for the queued heartbeats a WHERE clause selects, for the ledger"""
+        if self.ledger is None:
+            return []
+        try:
+            with self.lock:
+                return self.conn.execute(
+                    "SELECT date(time, 'unixepoch', 'localtime'),"
+                    " (SELECT value FROM labels WHERE labels.id = queue.project), COUNT(*)"
+                    f" FROM queue{where} GROUP BY 1, 2",
+                    params
+                ).fetchall()
+        except Exception as e:
+            log.error("offline.read_failed", error=str(e))
+            return []
+    
+    def remove_heartbeats(self, keys):
+        """Remove several heartbeats in a single transaction, returning how many were deleted"""
+        keys = list(keys)
+        if not keys:
+            return 0
+        try:
+            with self.lock, immediate_transaction(self.conn):
+                cursor = self.conn.executemany("DELETE FROM queue WHERE id = ?", [(int(k),) for k in keys])
+                self.stored = max(self.stored - cursor.rowcount, 0)
+            return cursor.rowcount
+        except Exception as e:
+            log.error("offline.remove_failed", error=str(e))
+            return 0
+    
+    def _filter_clause(self, project=None, since=None, until=None, after=None):
+        """WHERE clause and parameters for an optional project / [since, until) time filter, past a cursor"""
+        conditions = []
+        params = []
+        if after is not None:
+            # Keyset pagination on the (time, id) index: no OFFSET scan, and stable while rows are deleted
+            conditions.append("(time > ? OR (time = ? AND id > ?))")
+            params.extend([after[0], after[0], after[1]])
+        if project:
+            conditions.append("project = (SELECT id FROM labels WHERE value = ?)")
+            params.append(project)
+        if since is not None:
+            conditions.append("time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("time < ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+    
+    def count_offline_heartbeats(self, project=None, since=None, until=None):
+        """Number of heartbeats waiting to be synced, optionally filtered"""
+        # Buffered records are counted where they are rather than flushed: this runs on the UI thread
+        with self.buffer_lock:
+            buffered = sum(
+                1 for record in self.buffer
+                if (not project or record.project == project)
+                and (since is None or record.time >= since) and (until is None or record.time < until)
+            )
+        where, params = self._filter_clause(project, since, until)
+        try:
+            with self.lock:
+                stored = self.conn.execute(f"SELECT COUNT(*) FROM queue{where}", params).fetchone()[0]
+                if not where:
+                    self.stored = stored  # also picks up rows other processes added or synced
+        except Exception as e:
+            log.error("offline.count_failed", error=str(e))
+            stored = 0
+        return stored + buffered
+    
+    def depth(self):
+        """Approximate queue length from memory, cheap enough for a gauge polled on the UI thread"""
+        return self.stored + len(self.buffer)
+    
+    def delete_heartbeats(self, project=None, since=None, until=None):
+        """Delete every heartbeat matching the filter (all of them if none is given) in one transaction"""
+        self.flush()
+        where, params = self._filter_clause(project, since, until)
+        try:
+            with self.lock, immediate_transaction(self.conn):
+                groups = self._queued_groups(where, params)
+                deleted = self.conn.execute(f"DELETE FROM queue{where}", params).rowcount
+                self.stored = max(self.stored - deleted, 0)
+            if self.ledger:
+                self.ledger.record_discarded(groups)
+            log.info("offline.deleted", count=deleted, project=project, since=since, until=until)
+            return deleted
+        except Exception as e:
+            log.error("offline.delete_failed", error=str(e))
+            return 0
+    
+    def delete_all_heartbeats(self):
+        return self.delete_heartbeats()
+    
+    def read_heartbeats(self, project=None, since=None, until=None, after=None, limit=SEND_LIMIT):
+        """The next page of queued heartbeats in time order after a cursor; returns (records, cursor)
+        
+        The cursor is an opaque (time, id) position; pass it back as after= to resume from there.
+        Heartbeats still in the write buffer are not included until the next flush.
+        """
+        where, params = self._filter_clause(project, since, until, after)
+        try:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT id, time, project, language, entity, extra, owner FROM queue{where}"
+                    " ORDER BY time, id LIMIT ?",
+                    params + [limit]
+                ).fetchall()
+                records = [self._record(row) for row in rows]
+        except Exception as e:
+            log.error("offline.read_failed", error=str(e))
+            return [], after
+        if not rows:
+            return [], after
+        return records, (rows[-1][1], rows[-1][0])
+    
+    def iter_heartbeats(self, project=None, since=None, until=None, after=None, batch_size=SEND_LIMIT):
+        """Yield records in time order, holding at most batch_size of them in memory"""
+        while True:
+            records, after = self.read_heartbeats(project, since, until, after, batch_size)
+            yield from records
+            if len(records) < batch_size:
+                return
+    
+    def list_projects(self):
+        """Distinct project names present in the queue"""
+        with self.buffer_lock:
+            buffered = {record.project for record in self.buffer}
+        try:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT value FROM labels WHERE id IN (SELECT DISTINCT project FROM queue)"
+                ).fetchall()
+            return sorted(({project for project, in rows} | buffered) - {NO_PROJECT})
+        except Exception as e:
+            log.error("offline.projects_failed", error=str(e))
+            return []
+    
+    def sync_offline_heartbeats(self, api_key, bulk=True, force=False, max_heartbeats=SYNC_MAX_DEFAULT):
+        """Sync up to max_heartbeats offline heartbeats to the API in chunks of SEND_LIMIT, returning how many were synced"""
+        current_time = time.time()
+        if not force and current_time - self.last_sync_time < RATE_LIMIT_SECONDS:
+            return 0  # Rate limiting
+        
+        # One sync at a time across every process sharing the queue; two would read and send the same rows
+        if not self.sync_lock.acquire(blocking=False):
+            log.debug("sync.busy", path=self.db_path)
+            return 0
+        try:
+            synced, sent = self._sync_round(api_key, bulk, max_heartbeats)
+        finally:
+            self.sync_lock.release()
+        if not sent:
+            return 0
+        self.last_sync_time = current_time
+        return synced
+    
+    def _sync_round(self, api_key, bulk, max_heartbeats):
+        """Send queued heartbeats until max_heartbeats have been tried; returns (synced, tried)"""
+        # Stream the round one chunk at a time so memory stays flat however long the queue is;
+        # the cursor skips past chunks that failed instead of re-reading them
+        self.flush()  # reads leave the write buffer alone; a sync sends what it holds too
+        synced = 0
+        sent = 0
+        examined = 0
+        cursor = None
+        while examined < max_heartbeats:
+            chunk, cursor = self.read_heartbeats(after=cursor, limit=min(SEND_LIMIT, max_heartbeats - examined))
+            if not chunk:
+                break
+            if not examined:
+                log.info("sync.started", queued=self.count_offline_heartbeats())
+            examined += len(chunk)
+            records = {record.key: record for record in chunk}
+            # Records keep no token. Each is sent with the key it was queued for, and a plugin's
+            # heartbeats whose key this process does not know wait for the plugin to send again
+            by_key = {}
+            for record in chunk:
+                key = self.keys.get(record.owner) if record.owner else api_key
+                if key:
+                    by_key.setdefault(key, []).append(record)
+            
+            statuses = {}
+            borrowed = set()  # queued for a plugin's key rather than the app's
+            for key, group in by_key.items():
+                payloads = [(record.key, record.to_payload(key)) for record in group]
+                group_statuses = None
+                if bulk and self.bulk_supported is not False:
+                    group_statuses = self._send_bulk(payloads)
+                if group_statuses is None:
+                    group_statuses = self._send_pipelined(payloads)
+                statuses.update(group_statuses)
+                if key != api_key:
+                    borrowed.update(group_statuses)
+            sent += len(statuses)
+            
+            acked_keys = [key for key, status in statuses.items() if status in ACCEPTED_STATUSES]
+            # A refused plugin key is the plugin's problem: its heartbeats are dropped rather than kept
+            # to be retried under some other key, and the app's own keep going
+            retry_keys = [
+                key for key, status in statuses.items()
+                if retry_later(status) and not (key in borrowed and status in AUTH_FAILED_STATUSES)
+            ]
+            # Refused for what they contain: sending them again would fail again and, at the head
+            # of the queue, keep every later heartbeat from syncing
+            rejected_keys = [key for key in statuses if key not in acked_keys and key not in retry_keys]
+            
+            # Remove per chunk so an interrupted sync keeps what was already acknowledged
+            synced += self.remove_heartbeats(acked_keys)
+            if rejected_keys:
+                self.remove_heartbeats(rejected_keys)
+                log.warning("sync.rejected_dropped", count=len(rejected_keys))
+            if self.ledger:
+                self.ledger.record_synced((records[key].time, records[key].project) for key in acked_keys)
+                self.ledger.record_discarded(TimeLedger.group(
+                    (records[key].time, records[key].project) for key in rejected_keys
+                ))
+            metrics.inc("sync_heartbeats_total", len(acked_keys), result="acknowledged")
+            metrics.inc("sync_heartbeats_total", len(rejected_keys), result="rejected")
+            metrics.inc("sync_heartbeats_total", len(retry_keys), result="failed")
+            log.debug("sync.chunk", sent=sent, acknowledged=len(acked_keys), rejected=len(rejected_keys),
+                      waiting=len(chunk) - len(statuses), size=len(chunk))
+            if retry_keys:
+                # The API is down, rate limiting or refusing the key; the rest waits for the next round
+                log.info("sync.stopped", sent=sent, synced=synced)
+                break
+        return synced, sent
+    
+    def _send_bulk(self, chunk):
+        """POST a chunk as one batch payload; returns {key: status}, or None to send it one by one instead"""
+        try:
+            response = self.api.post(
+                HEARTBEATS_BULK_PATH,
+                json=[heartbeat_data for _, heartbeat_data in chunk],
+                headers={"Content-Type": "application/json"}
+            )
+        except Exception as e:
+            # Unreachable: the single endpoint would be no better
+            log.warning("sync.bulk_error", error=str(e))
+            return {key: None for key, _ in chunk}
+        
+        if response.status_code in BULK_UNSUPPORTED_STATUSES:
+            log.info("sync.bulk_unsupported", status=response.status_code)
+            self.bulk_supported = False
+            return None
+        if response.status_code not in ACCEPTED_STATUSES:
+            log.warning("sync.bulk_failed", status=response.status_code)
+            if retry_later(response.status_code) or response.status_code in AUTH_FAILED_STATUSES:
+                return {key: response.status_code for key, _ in chunk}
+            # e.g. 400 for one malformed heartbeat: find out which, without giving up on bulk
+            return None
+        self.bulk_supported = True
+        
+        statuses = {}
+        for (key, _), status in zip(chunk, bulk_statuses(response, len(chunk))):
+            if status not in ACCEPTED_STATUSES:
+                log.warning("sync.heartbeat_rejected", key=key, status=status)
+            statuses[key] = status
+        return statuses
+    
+    def _send_pipelined(self, chunk):
+        """POST each heartbeat of a chunk concurrently over the pooled session; returns {key: status}"""
+        def post(item):
+            key, heartbeat_data = item
+            try:
+                # No retries: a heartbeat that fails stays queued for the next round
+                response = self.api.post(
+                    "heartbeats",
+                    json=heartbeat_data,
+                    headers={"Content-Type": "application/json"},
+                    retries=0
+                )
+            except Exception as e:
+                log.warning("sync.heartbeat_error", key=key, error=str(e))
+                return key, None
+            if response.status_code not in ACCEPTED_STATUSES:
+                log.warning("sync.heartbeat_rejected", key=key, status=response.status_code)
+            return key, response.status_code
+        
+        with ThreadPoolExecutor(max_workers=SYNC_PIPELINE_WORKERS) as executor:
+            return dict(executor.map(post, chunk))
+
+def retry_later(status):
+    """Whether a heartbeat that got this status (None: no response) may go through if sent again later
+    
+    Network errors, rate limits, server errors and a refused API key are about the moment or the
+    key, not the heartbeat; any other refusal will be repeated however often it is sent.
+    """
+    return not isinstance(status, int) or status == 429 or status >= 500 or status in AUTH_FAILED_STATUSES
+
+def bulk_statuses(response, count):
+    """Per-heartbeat statuses of an accepted bulk request
+    
+    WakaTime-style bulk responses carry one [body, status] pair per heartbeat, in request
+    order; without them the whole batch counts as accepted.
+    """
+    try:
+        results = response.json().get("responses")
+    except (ValueError, AttributeError):
+        results = None
+    if not isinstance(results, list) or len(results) != count:
+        return [response.status_code] * count
+    return [result[1] if isinstance(result, (list, tuple)) and len(result) > 1 else None for result in results]
+
+def build_heartbeat(project, language, api_key, timestamp=None):
+    """The heartbeat payload the Adventure Time API expects for time logged against a project"""
+    return {
+        "entity": project,
+        "type": "file",
+        "time": int(time.time() if timestamp is None else timestamp),
+        "project": project,
+        "language": language,
+        "hackatimeToken": api_key,
+        "is_write": True
+    }
+
+class HeartbeatScheduler:
+    """Decides what each heartbeat tick does: coalesce it, send it, or queue it offline while the API is down"""
+    def __init__(self, offline_manager, api=None, coalesce_seconds=HEARTBEAT_COALESCE_SECONDS,
+                 backoff_base=HEARTBEAT_INTERVAL, backoff_cap=HEARTBEAT_BACKOFF_CAP, on_recovered=None, ledger=None):
+        self.offline_manager = offline_manager
+        self.ledger = ledger
+        self.api = api or api_client
+        self.coalesce_seconds = coalesce_seconds
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.on_recovered = on_recovered
+        self.lock = threading.Lock()
+        self.last_times = {}  # (entity, project, language) -> time of the last heartbeat let through
+        self.failures = 0
+        self.backoff_until = 0
+    
+    def submit(self, payload, coalesce=True):
+        """Handle one heartbeat (blocking; call from a worker). Returns a status string, or None if coalesced"""
+        return self.submit_batch([payload], coalesce)[0]
+    
+    def submit_batch(self, payloads, coalesce=True):
+        """Handle one tick's heartbeats together, sent as a single bulk request; returns a status per payload"""
+        statuses = [None] * len(payloads)
+        pending = []
+        with self.lock:
+            for index, payload in enumerate(payloads):
+                signature = (payload.get('entity'), payload.get('project'), payload.get('language'))
+                last_time = self.last_times.get(signature)
+                # Hackatime dedups heartbeats for the same entity anyway; only one per window is worth sending
+                if coalesce and last_time is not None and payload['time'] - last_time < self.coalesce_seconds:
+                    metrics.inc("heartbeats_total", result="coalesced")
+                    continue
+                self.last_times[signature] = payload['time']
+                pending.append(index)
+            if len(self.last_times) > 1000:
+                horizon = max(self.last_times.values()) - self.coalesce_seconds
+                self.last_times = {sig: t for sig, t in self.last_times.items() if t > horizon}
+            backoff_remaining = self.backoff_until - time.monotonic()
+        if not pending:
+            return statuses
+        
+        if backoff_remaining > 0:
+            # The API is failing: queue straight away instead of waiting on another timeout
+            for index in pending:
+                self.offline_manager.save_heartbeat_offline(payloads[index])
+                self._record(payloads[index], sent=False)
+                statuses[index] = f"Offline: retrying in {int(backoff_remaining) + 1}s"
+            metrics.inc("heartbeats_total", len(pending), result="queued")
+            return statuses
+        
+        started = time.monotonic()
+        try:
+            results = self._post([payloads[index] for index in pending])
+            metrics.observe("heartbeat_latency_seconds", time.monotonic() - started)
+        except Exception as e:
+            log.warning("heartbeat.error", error=str(e))
+            results = ["Offline: Network Error"] * len(pending)
+        
+        failed = 0
+        for index, status in zip(pending, results):
+            statuses[index] = status
+            if status:
+                # Save to offline storage if the API call fails
+                self.offline_manager.save_heartbeat_offline(payloads[index])
+                failed += 1
+            self._record(payloads[index], sent=not status)
+        metrics.inc("heartbeats_total", len(pending) - failed, result="sent")
+        metrics.inc("heartbeats_total", failed, result="failed")
+        if failed < len(pending):
+            self.record_success(payloads[pending[0]].get('hackatimeToken'))
+        else:
+            self.record_failure()
+        return statuses
+    
+    def _record(self, payload, sent):
+        if self.ledger:
+            self.ledger.record_heartbeat(payload.get('project'), payload['time'], sent)
+    
+    def _post(self, payloads):
+        """Send heartbeats, several at once through the bulk endpoint when it exists; "" or an error status for each"""
+        headers = {"Content-Type": "application/json"}
+        if len(payloads) > 1 and self.offline_manager.bulk_supported is not False:
+            response = self.api.post(HEARTBEATS_BULK_PATH, json=payloads, headers=headers, retries=0)
+            log.debug("heartbeat.response", status=response.status_code, body=response.text)
+            if response.status_code in ACCEPTED_STATUSES:
+                self.offline_manager.bulk_supported = True
+                return [
+                    "" if status in ACCEPTED_STATUSES else f"Offline: {status}"
+                    for status in bulk_statuses(response, len(payloads))
+                ]
+            if retry_later(response.status_code):
+                return [f"Offline: {response.status_code}"] * len(payloads)
+            if response.status_code in BULK_UNSUPPORTED_STATUSES:
+                self.offline_manager.bulk_supported = False
+            # Otherwise one heartbeat spoiled the batch (e.g. 400): send them singly to keep the rest
+        
+        statuses = []
+        for payload in payloads:
+            try:
+                # Backoff is handled here, across ticks
+                response = self.api.post("heartbeats", json=payload, headers=headers, retries=0)
+            except Exception as e:
+                if len(payloads) == 1:
+                    raise
+                log.warning("heartbeat.error", error=str(e))
+                statuses.append("Offline: Network Error")
+                continue
+            log.debug("heartbeat.response", status=response.status_code, body=response.text)
+            statuses.append("" if response.status_code in ACCEPTED_STATUSES else f"Offline: {response.status_code}")
+        return statuses
+    
+    def backoff_remaining(self):
+        """Seconds until the API is worth trying again after failures; 0 when it is not backing off"""
+        with self.lock:
+            return max(self.backoff_until - time.monotonic(), 0)
+    
+    def record_success(self, api_key):
+        with self.lock:
+            recovered = self.failures > 0
+            self.failures = 0
+            self.backoff_until = 0
+        if recovered:
+            log.info("heartbeat.recovered")
+            if self.on_recovered:
+                self.on_recovered(api_key)
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            delay = min(self.backoff_cap, self.backoff_base * (2 ** (self.failures - 1)))
+            self.backoff_until = time.monotonic() + delay
+    
+    def reset(self, project=None):
+        """Forget coalescing state (for one project, or all), e.g. when a new logging session starts"""
+        with self.lock:
+            if project is None:
+                self.last_times.clear()
+            else:
+                self.last_times = {sig: t for sig, t in self.last_times.items() if sig[1] != project}
+
+class TrackingSession:
+    """One project being tracked: its own timer, optional time limit and last heartbeat status"""
+    def __init__(self, project, language, app_name=None, limit_seconds=None):
+        self.project = project
+        self.language = language
+        self.app_name = app_name
+        self.limit_seconds = limit_seconds
+        self.timer = TimerEngine()
+        self.started_at = None
+        self.status = ""
+    
+    @property
+    def id(self):
+        return self.project, self.language
+    
+    def expired(self):
+        return self.limit_seconds is not None and self.timer.elapsed() >= self.limit_seconds
+    
+    def heartbeat(self, api_key):
+        return build_heartbeat(self.project, self.language, api_key, self.timer.wall_time())
+
+class SessionManager:
+    """Concurrent tracking sessions driven by one shared tick, their heartbeats sent as one batch"""
+    def __init__(self, scheduler, ledger=None):
+        self.scheduler = scheduler
+        self.ledger = ledger
+        self.lock = threading.Lock()
+        self.sessions = {}  # (project, language) -> TrackingSession, in start order
+        self.paused = False  # while idle: timers stopped and no heartbeats sent
+    
+    def start(self, project, language, app_name=None, limit_seconds=None):
+        """Start tracking a project; a session already running for it is returned unchanged"""
+        with self.lock:
+            session = self.sessions.get((project, language))
+            if session is None:
+                session = TrackingSession(project, language, app_name, limit_seconds)
+                self.sessions[session.id] = session
+                # A fresh session's first heartbeat must not be coalesced into an earlier one
+                self.scheduler.reset(project)
+                session.timer.start()
+                session.started_at = time.time()
+                if self.paused:
+                    session.timer.pause()
+            return session
+    
+    def stop(self, session):
+        """Stop a session and return its final elapsed seconds"""
+        with self.lock:
+            self.sessions.pop(session.id, None)
+        seconds = session.timer.stop()
+        if self.ledger:
+            self.ledger.record_session(session.project, session.language, session.started_at, seconds)
+        return seconds
+    
+    def get(self, project, language):
+        with self.lock:
+            return self.sessions.get((project, language))
+    
+    def running(self):
+        with self.lock:
+            return list(self.sessions.values())
+    
+    def expired(self):
+        return [session for session in self.running() if session.expired()]
+    
+    def pause(self, rewind=0):
+        """Pause every session's timer, taking back the last rewind seconds they counted while idle"""
+        with self.lock:
+            self.paused = True
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.timer.pause(rewind)
+    
+    def resume(self):
+        with self.lock:
+            self.paused = False
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.timer.resume()
+    
+    def tick(self, api_key, sessions=None, coalesce=True):
+        """Send one heartbeat for every running session (or just the given ones) as a single batch
+        
+        Blocking; call from a worker. Returns (session, status) pairs, status None where coalesced.
+        """
+        sessions = self.running() if sessions is None else sessions
+        if not sessions:
+            return []
+        if self.paused:
+            metrics.inc("heartbeats_total", len(sessions), result="idle")
+            return []
+        statuses = self.scheduler.submit_batch([session.heartbeat(api_key) for session in sessions], coalesce)
+        for session, status in zip(sessions, statuses):
+            if status is not None:
+                session.status = status
+        return list(zip(sessions, statuses))
+
+def system_idle_source():
+    """Seconds since the last keyboard or mouse input anywhere on the machine, as a callable; None where unknown"""
+    if sys.platform == "win32":
+        import ctypes
+        
+        class LastInputInfo(ctypes.Structure):
+            _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+        
+        def idle_seconds():
+            info = LastInputInfo(ctypes.sizeof(LastInputInfo), 0)
+            if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+                return None
+            return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000
+        return idle_seconds
+    
+    import shutil
+    import subprocess
+    if sys.platform == "darwin":
+        def idle_seconds():
+            output = subprocess.run(["ioreg", "-c", "IOHIDSystem", "-d", "4"],
+                                    capture_output=True, text=True, timeout=2).stdout
+            for line in output.splitlines():
+                if "HIDIdleTime" in line:
+                    return int(line.rsplit("=", 1)[1]) / 1e9
+            return None
+        return idle_seconds
+    if shutil.which("xprintidle") and os.environ.get("DISPLAY"):
+        def idle_seconds():
+            output = subprocess.run(["xprintidle"], capture_output=True, text=True, timeout=2).stdout
+            return int(output) / 1000 if output.strip().isdigit() else None
+        return idle_seconds
+    return None
+
+class IdleMonitor:
+    """Tells when the user has gone idle from reported activity plus pluggable idle sources
+    
+    Input events and editor heartbeats call note_activity(); each source is a callable returning
+    seconds since the last input it saw (or None). The user is idle once every signal is older
+    than threshold seconds. on_idle(idle_seconds) and on_active() run through dispatch on each change.
+    """
+    def __init__(self, threshold, sources=(), on_idle=None, on_active=None, dispatch=call_on_main_thread):
+        self.threshold = threshold
+        self.sources = [source for source in sources if source is not None]
+        self.on_idle = on_idle
+        self.on_active = on_active
+        self.dispatch = dispatch
+        self.lock = threading.Lock()
+        self.last_activity = time.monotonic()
+        self.idle = False
+    
+    def note_activity(self):
+        """Record input now; resumes straight away if the user was idle (cheap enough for every mouse move)"""
+        with self.lock:
+            self.last_activity = time.monotonic()
+            was_idle, self.idle = self.idle, False
+        if was_idle:
+            self._changed(False)
+    
+    def idle_seconds(self):
+        idle = time.monotonic() - self.last_activity
+        for source in self.sources:
+            try:
+                seconds = source()
+            except Exception as e:
+                log.debug("idle.source_failed", error=str(e))
+                continue
+            if seconds is not None:
+                idle = min(idle, seconds)
+        return idle
+    
+    def poll(self):
+        """Check every signal, firing on_idle or on_active if the state changed; returns True while idle"""
+        idle_for = self.idle_seconds()
+        idle = idle_for >= self.threshold
+        with self.lock:
+            changed = idle != self.idle
+            self.idle = idle
+        if changed:
+            self._changed(idle, idle_for)
+        return idle
+    
+    def _changed(self, idle, idle_for=0):
+        metrics.set_gauge("idle", int(idle))
+        if idle:
+            log.info("idle.paused", idle_seconds=int(idle_for))
+            metrics.inc("idle_pauses_total")
+            if self.on_idle:
+                self.dispatch(lambda: self.on_idle(idle_for))
+        else:
+            log.info("idle.resumed")
+            if self.on_active:
+                self.dispatch(self.on_active)
+
+class SyncWorker(threading.Thread):
+    """Background thread that drains the offline queue on a timer or when connectivity returns"""
+    def __init__(self, offline_manager, interval=RATE_LIMIT_SECONDS, on_progress=None, dispatch=call_on_main_thread):
+        super().__init__(name="offline-sync", daemon=True)
+        self.offline_manager = offline_manager
+        self.dispatch = dispatch
+        self.interval = interval
+        self.on_progress = on_progress
+        self.api_key = ""
+        self.scheduler = None  # the HeartbeatScheduler whose backoff says the API is down
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.catch_up = False
+    
+    def wake(self, catch_up=False):
+        """Run a sync round now; catch_up skips the rate limit and keeps going until the queue is empty"""
+        if catch_up:
+            self.catch_up = True
+        self.wake_event.set()
+    
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+            if self.stop_event.is_set():
+                break
+            catch_up, self.catch_up = self.catch_up, False
+            try:
+                self.sync_round(catch_up)
+            except Exception as e:
+                log.error("sync.worker_error", error=str(e))
+    
+    def sync_round(self, catch_up):
+        api_key = self.api_key
+        # Gateway plugins' heartbeats go out with their own keys, signed in or not
+        if not (api_key or self.offline_manager.keys) or not self.offline_manager.count_offline_heartbeats():
+            return
+        backoff = self.scheduler.backoff_remaining() if self.scheduler else 0
+        if backoff > 0:
+            # Live heartbeats are already failing; the scheduler wakes us with catch_up once one gets through
+            log.debug("sync.skipped", backoff_seconds=round(backoff, 1))
+            return
+        started = time.monotonic()
+        total = 0
+        while not self.stop_event.is_set():
+            # Bounded rounds of SYNC_MAX_DEFAULT; each chunk is deleted as soon as it is acknowledged,
+            # so a crash part-way through never resends what the server already accepted
+            synced = self.offline_manager.sync_offline_heartbeats(api_key, force=catch_up)
+            total += synced
+            if not catch_up or not synced:
+                break
+        if total:
+            elapsed = max(time.monotonic() - started, 1e-3)
+            backlog = self.offline_manager.count_offline_heartbeats()
+            metrics.set_gauge("sync_throughput_per_second", total / elapsed)
+            self.report(f"Synced {total} heartbeats ({total / elapsed:.0f}/s), {backlog} still queued")
+    
+    def report(self, text):
+        log.info("sync.progress", message=text)
+        if self.on_progress:
+            self.dispatch(lambda: self.on_progress(text))
+
+class MetadataCache:
+    """TTL cache for app and project lists, persisted so a restart can show the last known values at once"""
+    def __init__(self, path=METADATA_CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.generation = 0  # bumped by invalidate(), so results of requests started before it are dropped
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+    
+    def get(self, key, ttl):
+        """Return (value, fresh); value is None on a miss, fresh is False once the entry is older than ttl"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None, False
+        return entry["value"], time.time() - entry["fetched_at"] < ttl
+    
+    def put(self, key, value, generation=None):
+        """Store a value; given the generation read when its request started, drop it if invalidated since"""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = {"value": value, "fetched_at": time.time()}
+            self._save()
+    
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.entries = {}
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+    
+    def _save(self):
+        # Write-then-rename so a crash never leaves a truncated cache behind
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.error("cache.save_failed", error=str(e))
+
+def local_day(timestamp):
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+class TimeLedger:
+    """Local history of tracked time: sessions, plus per-day, per-project rollups of heartbeat outcomes
+    
+    Every heartbeat updates one rollup row, so today/week totals are a handful of rows to read
+    however much history there is. Time is confirmed once the API has accepted its heartbeat and
+    pending while that heartbeat waits in the offline queue.
+    """
+    def __init__(self, db_path=TIME_LEDGER_DB, gap_cap=HEARTBEAT_GAP_CAP):
+        self.db_path = db_path
+        self.gap_cap = gap_cap
+        self.lock = threading.RLock()
+        self._conn = None
+        self.last_heartbeat = {}  # project -> time of its previous heartbeat
+    
+    @property
+    def conn(self):
+        if self._conn is None:
+            with self.lock:
+                if self._conn is None:
+                    conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS sessions ("
+                        " id INTEGER PRIMARY KEY,"
+                        " project TEXT NOT NULL,"
+                        " language TEXT,"
+                        " started REAL NOT NULL,"
+                        " seconds REAL NOT NULL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started)")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS rollups ("
+                        " day TEXT NOT NULL,"
+                        " project TEXT NOT NULL,"
+                        " confirmed_seconds REAL NOT NULL DEFAULT 0,"
+                        " pending_seconds REAL NOT NULL DEFAULT 0,"
+                        " pending_count INTEGER NOT NULL DEFAULT 0,"  # heartbeats still queued
+                        " sent INTEGER NOT NULL DEFAULT 0,"
+                        " queued INTEGER NOT NULL DEFAULT 0,"
+                        " synced INTEGER NOT NULL DEFAULT 0,"
+                        " PRIMARY KEY (day, project))"
+                    )
+                    conn.commit()
+                    self._conn = conn
+        return self._conn
+    
+    def record_session(self, project, language, started, seconds):
+        project = project or NO_PROJECT
+        try:
+            with self.lock, immediate_transaction(self.conn):
+                self.conn.execute(
+                    "INSERT INTO sessions (project, language, started, seconds) VALUES (?, ?, ?, ?)",
+                    (project, language, started, seconds)
+                )
+        except Exception as e:
+            log.error("ledger.session_failed", error=str(e))
+    
+    def record_heartbeat(self, project, timestamp, sent):
+        """Credit the time since the project's previous heartbeat as confirmed (sent) or pending (queued)"""
+        project = project or NO_PROJECT  # as the offline queue stores it, so settling finds the same row
+        with self.lock:
+            previous = self.last_heartbeat.get(project)
+            self.last_heartbeat[project] = max(timestamp, previous or timestamp)
+            gap = timestamp - previous if previous is not None else 0
+            seconds = gap if 0 < gap <= self.gap_cap else 0
+            try:
+                with immediate_transaction(self.conn):
+                    if sent:
+                        self.conn.execute(
+                            "INSERT INTO rollups (day, project, confirmed_seconds, sent) VALUES (?, ?, ?, 1)"
+                            " ON CONFLICT (day, project) DO UPDATE SET"
+                            " confirmed_seconds = confirmed_seconds + excluded.confirmed_seconds, sent = sent + 1",
+                            (local_day(timestamp), project, seconds)
+                        )
+                    else:
+                        self.conn.execute(
+                            "INSERT INTO rollups (day, project, pending_seconds, pending_count, queued)"
+                            " VALUES (?, ?, ?, 1, 1)"
+                            " ON CONFLICT (day, project) DO UPDATE SET"
+                            " pending_seconds = pending_seconds + excluded.pending_seconds,"
+                            " pending_count = pending_count + 1, queued = queued + 1",
+                            (local_day(timestamp), project, seconds)
+                        )
+            except Exception as e:
+                log.error("ledger.heartbeat_failed", error=str(e))
+    
+    def record_synced(self, heartbeats):
+        """Move pending time to confirmed for queued (timestamp, project) heartbeats the API has now accepted"""
+        self._settle(self.group(heartbeats), confirm=True)
+    
+    def record_discarded(self, groups):
+        """Drop pending time for queued heartbeats deleted unsynced; groups are (day, project, count)"""
+        self._settle(groups, confirm=False)
+    
+    @staticmethod
+    def group(heartbeats):
+        """(local day, project, count) groups for (timestamp, project) heartbeats"""
+        counts = {}
+        for timestamp, project in heartbeats:
+            key = (local_day(timestamp), project or NO_PROJECT)
+            counts[key] = counts.get(key, 0) + 1
+        return [(day, project, count) for (day, project), count in counts.items()]
+    
+    def _settle(self, groups, confirm):
+        # Queued heartbeats of one day and project are interchangeable here: each settles an equal share
+        try:
+            with self.lock, immediate_transaction(self.conn):
+                for day, project, count in groups:
+                    row = self.conn.execute(
+                        "SELECT pending_seconds, pending_count FROM rollups WHERE day = ? AND project = ?",
+                        (day, project)
+                    ).fetchone()
+                    if not row or not row[1]:
+                        continue
+                    pending_seconds, pending_count = row
+                    count = min(count, pending_count)
+                    share = pending_seconds if count == pending_count else pending_seconds * count / pending_count
+                    self.conn.execute(
+                        "UPDATE rollups SET pending_seconds = pending_seconds - ?, pending_count = pending_count - ?,"
+                        " confirmed_seconds = confirmed_seconds + ?, synced = synced + ?"
+                        " WHERE day = ? AND project = ?",
+                        (share, count, share if confirm else 0, count if confirm else 0, day, project)
+                    )
+        except Exception as e:
+            log.error("ledger.settle_failed", error=str(e))
+    
+    def totals(self, since_day, project=None):
+        """Confirmed and pending seconds from since_day (a local YYYY-MM-DD) on"""
+        query = "SELECT COALESCE(SUM(confirmed_seconds), 0), COALESCE(SUM(pending_seconds), 0) FROM rollups WHERE day >= ?"
+        params = [since_day]
+        if project:
+            query += " AND project = ?"
+            params.append(project)
+        try:
+            with self.lock:
+                confirmed, pending = self.conn.execute(query, params).fetchone()
+        except Exception as e:
+            log.error("ledger.read_failed", error=str(e))
+            confirmed = pending = 0
+        return {"confirmed": confirmed, "pending": pending}
+    
+    def today(self, project=None):
+        return self.totals(local_day(time.time()), project)
+    
+    def week(self, project=None):
+        """Totals since Monday"""
+        now = time.localtime()
+        return self.totals(local_day(time.time() - now.tm_wday * 86400), project)
+    
+    def by_project(self, since_day):
+        try:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT project, SUM(confirmed_seconds), SUM(pending_seconds) FROM rollups"
+                    " WHERE day >= ? GROUP BY project ORDER BY SUM(confirmed_seconds + pending_seconds) DESC",
+                    (since_day,)
+                ).fetchall()
+        except Exception as e:
+            log.error("ledger.read_failed", error=str(e))
+            return []
+        return [(project, {"confirmed": confirmed, "pending": pending}) for project, confirmed, pending in rows]
+    
+    def sessions(self, since, until=None):
+        """Recorded sessions that started in [since, until), oldest first"""
+        try:
+            with self.lock:
+                return self.conn.execute(
+                    "SELECT project, language, started, seconds FROM sessions WHERE started >= ? AND started < ?"
+                    " ORDER BY started",
+                    (since, time.time() if until is None else until)
+                ).fetchall()
+        except Exception as e:
+            log.error("ledger.read_failed", error=str(e))
+            return []
+
+class SettingsStore:
+    """Credentials and last-used selections in one JSON file: loaded once, saved debounced and atomically"""
+    # Files that held the API key and auth token before the settings store existed
+    LEGACY_FILES = {"api_key": HACKATIME_KEY_FILE, "auth_token": TOKEN_FILE}
+    
+    def __init__(self, path=SETTINGS_FILE, save_delay=SETTINGS_SAVE_DELAY):
+        self.path = path
+        self.save_delay = save_delay
+        self.lock = threading.Lock()
+        self.values = None  # loaded on first access
+        self.changed_at = 0
+        self.dirty = threading.Event()
+        self.closed = False
+        self.saver = None
+        self.failures = 0  # consecutive failed saves, for the retry backoff
+    
+    def _load(self):
+        if self.values is not None:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.values = json.load(f)
+            return
+        except (OSError, ValueError):
+            self.values = {}
+        for name, legacy_path in self.LEGACY_FILES.items():
+            try:
+                with open(legacy_path, 'r') as f:
+                    value = f.read().strip()
+            except OSError:
+                continue
+            if value:
+                self.values[name] = value
+                self._mark_dirty()
+    
+    def get(self, name, default=None):
+        with self.lock:
+            self._load()
+            return self.values.get(name, default)
+    
+    def set(self, name, value):
+        self.update(**{name: value})
+    
+    def update(self, **values):
+        with self.lock:
+            self._load()
+            changed = {name: value for name, value in values.items() if self.values.get(name) != value}
+            if not changed:
+                return
+            self.values.update(changed)
+            self._mark_dirty()
+        if self.closed:
+            self.flush()
+    
+    def delete(self, *names):
+        with self.lock:
+            self._load()
+            removed = [self.values.pop(name, None) for name in names]
+            if any(value is not None for value in removed):
+                self._mark_dirty()
+        if self.closed:
+            self.flush()
+    
+    def _mark_dirty(self):
+        self.changed_at = time.monotonic()
+        self.dirty.set()
+        if self.saver is None and not self.closed:
+            self.saver = threading.Thread(target=self._save_loop, name="settings-save", daemon=True)
+            self.saver.start()
+    
+    def _save_loop(self):
+        while True:
+            self.dirty.wait()
+            if self.closed:
+                return
+            # Keep waiting while edits are still arriving; only the last state is written
+            while True:
+                remaining = self.changed_at + self.save_delay - time.monotonic()
+                if remaining <= 0 or self.closed:
+                    break
+                time.sleep(remaining)
+            if self.flush():
+                self.failures = 0
+            else:
+                # e.g. a read-only install folder: retrying at once would spin a core on the same error
+                self.failures += 1
+                time.sleep(min(self.save_delay * 2 ** self.failures, SETTINGS_RETRY_CAP))
+    
+    def flush(self):
+        """Write pending changes now; returns False if the file could not be written"""
+        with self.lock:
+            if not self.dirty.is_set():
+                return True
+            snapshot = dict(self.values)
+            self.dirty.clear()
+        try:
+            # Write-then-rename so a crash never leaves a half-written file; owner-only as it holds credentials
+            tmp_path = self.path + '.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.error("settings.save_failed", error=str(e))
+            self.dirty.set()
+            return False
+        # Everything now lives in the settings file
+        for legacy_path in self.LEGACY_FILES.values():
+            try:
+                os.remove(legacy_path)
+            except OSError:
+                pass
+        log.debug("settings.saved", path=self.path)
+        return True
+    
+    def close(self):
+        self.closed = True
+        self.flush()
+        self.dirty.set()  # let the saver thread exit
+
+settings = SettingsStore()
+
+class ImageCache:
+    """Size-bounded on-disk image cache: files are named by content hash, looked up by URL, evicted LRU"""
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}  # url -> {"file", "size", "etag", "last_modified", "last_used"}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            pass
+    
+    def fetch(self, url):
+        """Return a local path for url, revalidating any cached copy (blocking; run on a worker)"""
+        with self.lock:
+            entry = self.index.get(url)
+        if entry and not os.path.exists(os.path.join(self.directory, entry["file"])):
+            entry = None
+        
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = api_client.get(url, headers=headers, stream=True)
+        except Exception as e:
+            if entry:
+                log.warning("image.offline_cached", url=url, error=str(e))
+                return self._touch(url)
+            raise
+        
+        if response.status_code == 304 and entry:
+            response.close()
+            return self._touch(url)
+        if response.status_code != 200:
+            response.close()
+            log.warning("image.download_failed", url=url, status=response.status_code)
+            return self._touch(url) if entry else None
+        
+        import mimetypes
+        import tempfile
+        content_type = response.headers.get('content-type')
+        ext = mimetypes.guess_extension(content_type) or '.png'
+        digest = hashlib.sha256()
+        size = 0
+        temp_file = tempfile.NamedTemporaryFile(dir=self.directory, delete=False, suffix='.part')
+        try:
+            for chunk in response.iter_content(IMAGE_CHUNK_SIZE):
+                temp_file.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            temp_file.close()
+            file_name = digest.hexdigest() + ext
+            os.replace(temp_file.name, os.path.join(self.directory, file_name))
+        except Exception:
+            temp_file.close()
+            os.remove(temp_file.name)
+            raise
+        
+        with self.lock:
+            self.index[url] = {
+                "file": file_name,
+                "size": size,
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified'),
+                "last_used": time.time(),
+            }
+            self._evict()
+            self._save_index()
+        return os.path.join(self.directory, file_name)
+    
+    def _touch(self, url):
+        with self.lock:
+            entry = self.index[url]
+            entry["last_used"] = time.time()
+            self._save_index()
+        return os.path.join(self.directory, entry["file"])
+    
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes (caller holds the lock)"""
+        files = {}
+        for entry in self.index.values():
+            files[entry["file"]] = entry["size"]
+        total = sum(files.values())
+        for url, entry in sorted(self.index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            del self.index[url]
+            # Identical images share one file; only delete it once nothing points at it
+            if all(other["file"] != entry["file"] for other in self.index.values()):
+                total -= entry["size"]
+                try:
+                    os.remove(os.path.join(self.directory, entry["file"]))
+                except OSError:
+                    pass
+    
+    def _save_index(self):
+        try:
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f, separators=(',', ':'))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            log.error("image.index_save_failed", error=str(e))
+
+
+def suspend_aware_clock():
+    """Monotonic seconds that keep counting while the machine sleeps, where the OS allows it"""
+    # CLOCK_BOOTTIME (Linux) includes suspend; plain monotonic is the portable fallback
+    if hasattr(time, 'CLOCK_BOOTTIME'):
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    return time.monotonic()
+
+class TimerEngine:
+    """Elapsed time built from monotonic anchors, so a stalled or skipped Clock tick never loses time"""
+    def __init__(self, clock=suspend_aware_clock):
+        self.clock = clock
+        self.closed_seconds = 0.0  # total of finished running segments
+        self.segment_start = None  # clock() when the current segment began, None while paused
+        self.segment_wall_start = None
+    
+    @property
+    def running(self):
+        return self.segment_start is not None
+    
+    def start(self):
+        """Reset to zero and start a fresh running segment"""
+        self.closed_seconds = 0.0
+        self.segment_start = None
+        self.resume()
+    
+    def resume(self):
+        if self.running:
+            return
+        self.segment_start = self.clock()
+        self.segment_wall_start = time.time()
+    
+    def pause(self, rewind=0):
+        """Stop counting; rewind takes back up to that many seconds of the segment, e.g. time found to be idle"""
+        if not self.running:
+            return
+        self.closed_seconds += max(self.clock() - self.segment_start - rewind, 0)
+        self.segment_start = None
+        self.segment_wall_start = None
+    
+    def stop(self):
+        """Pause and return the final elapsed seconds"""
+        self.pause()
+        return self.closed_seconds
+    
+    def elapsed(self):
+        if self.running:
+            return self.closed_seconds + (self.clock() - self.segment_start)
+        return self.closed_seconds
+    
+    def wall_time(self):
+        """Current wall-clock time derived from the segment anchor, immune to clock adjustments mid-segment"""
+        if self.running:
+            return self.segment_wall_start + (self.clock() - self.segment_start)
+        return time.time()
+
+class RequestExecutor:
+    """Runs blocking network calls on worker threads and hands results back through dispatch (the Kivy main thread by default)"""
+    def __init__(self, max_workers=REQUEST_WORKERS, dispatch=call_on_main_thread):
+        self.dispatch = dispatch
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="request")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.generations = {}  # tag -> generation, bumped by cancel()
+        self.latencies = deque(maxlen=50)
+    
+    def submit(self, fn, *args, on_success=None, on_error=None, tag=None):
+        """Run fn(*args) in the background; the matching callback gets the result or exception on the main thread"""
+        with self.lock:
+            self.pending += 1
+            generation = self.generations.get(tag, 0)
+        submitted = time.monotonic()
+        
+        def is_current():
+            return tag is None or self.generations.get(tag, 0) == generation
+        
+        def deliver(callback, value):
+            # A cancel() may land between scheduling and delivery, so check again here
+            if callback and is_current():
+                callback(value)
+        
+        def run():
+            error = None
+            result = None
+            try:
+                result = fn(*args)
+            except Exception as e:
+                error = e
+            with self.lock:
+                self.pending -= 1
+                self.latencies.append(time.monotonic() - submitted)
+                current = is_current()
+            if not current:
+                return
+            if error is not None:
+                if on_error is None:
+                    log.error("request.unhandled_error", function=getattr(fn, '__name__', str(fn)), error=str(error))
+                self.dispatch(lambda: deliver(on_error, error))
+            else:
+                self.dispatch(lambda: deliver(on_success, result))
+        
+        return self.pool.submit(run)
+    
+    def cancel(self, tag):
+        """Drop the callbacks of every request submitted so far under tag"""
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+    
+    def stats(self):
+        """Return (requests in flight or queued, average latency in ms over recent requests)"""
+        with self.lock:
+            latencies = list(self.latencies)
+            pending = self.pending
+        average_ms = 1000 * sum(latencies) / len(latencies) if latencies else 0
+        return pending, average_ms
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+request_executor = RequestExecutor()
+
+class HeartbeatGateway:
+    """WakaTime-compatible /heartbeats endpoint on localhost that batches editor plugins' heartbeats upstream
+    
+    Point a plugin's api_url at http://127.0.0.1:PORT/api/v1. Heartbeats it sends are deduplicated
+    and written to the offline queue before the request is answered, so an acknowledged heartbeat
+    survives a crash. on_queued is then called at most every batch_interval seconds (or once
+    batch_size have arrived) to start a sync, which sends them upstream in bulk over the pooled
+    API connection.
+    
+    Any local process, web pages included, can reach the port, so the gateway never lends out the
+    app's key: each request must carry the plugin's own key, be sent as JSON and come from no
+    browser Origin (a page can only send a key and JSON after a CORS preflight, which is refused).
+    Heartbeats are queued under the key they came with and only ever synced with it; one a plugin's
+    key gets refused for is dropped, without holding up the app's own heartbeats or backing them off.
+    """
+    def __init__(self, offline_manager, ledger=None, host="127.0.0.1", port=0,
+                 batch_size=SEND_LIMIT, batch_interval=GATEWAY_BATCH_SECONDS):
+        self.offline_manager = offline_manager
+        self.ledger = ledger
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.pending = 0  # heartbeats queued since on_queued was last called
+        self.pending_lock = threading.Lock()
+        self.seen = OrderedDict()  # identities of recently accepted heartbeats, oldest first
+        self.flush_event = threading.Event()
+        self.closed = False
+        self.server = None
+        self.forwarder = None
+        self.on_activity = None  # called when a plugin reports something the user is doing now
+        self.on_queued = None  # called after heartbeats were added to the offline queue
+    
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/api/v1"
+    
+    def start(self):
+        """Start serving and forwarding from daemon threads; returns the bound port"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        gateway = self
+        
+        class GatewayHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_POST(self):
+                path = self.path.split("?", 1)[0].rstrip("/")
+                if not path.endswith(("/heartbeats", "/heartbeats.bulk", "/heartbeats/bulk")):
+                    self.send_error(404)
+                    return
+                if self.headers.get("Origin"):
+                    metrics.inc("gateway_requests_rejected_total", reason="origin")
+                    self.send_error(403, "Browser requests are not accepted")
+                    return
+                content_type = (self.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+                if content_type != "application/json":
+                    metrics.inc("gateway_requests_rejected_total", reason="content_type")
+                    self.send_error(415, "Send heartbeats as application/json")
+                    return
+                api_key = gateway.request_key(self.headers.get("Authorization"))
+                if not api_key:
+                    metrics.inc("gateway_requests_rejected_total", reason="no_key")
+                    self.send_error(401, "Send your Hackatime API key as Basic or Bearer authorization")
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > GATEWAY_MAX_BODY:
+                    self.send_error(413)
+                    return
+                try:
+                    body = json.loads(self.rfile.read(length) or b"null")
+                except ValueError:
+                    self.send_error(400, "Invalid JSON")
+                    return
+                bulk = isinstance(body, list)
+                if not bulk and not isinstance(body, dict):
+                    self.send_error(400, "Expected a heartbeat or a list of heartbeats")
+                    return
+                results = gateway.accept(body if bulk else [body], api_key)
+                if bulk or path.endswith("bulk"):
+                    reply = {"responses": [[data, status] for data, status in results]}
+                else:
+                    reply, status = results[0]
+                    if status >= 400:
+                        self.send_error(status, reply["error"])
+                        return
+                encoded = json.dumps(reply).encode()
+                self.send_response(202)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+        
+        self.server = ThreadingHTTPServer((self.host, self.port), GatewayHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="heartbeat-gateway", daemon=True).start()
+        self.forwarder = threading.Thread(target=self._forward_loop, name="gateway-forward", daemon=True)
+        self.forwarder.start()
+        log.info("gateway.serving", url=self.url)
+        return self.port
+    
+    @staticmethod
+    def request_key(authorization):
+        """The API key from a plugin's Authorization header (WakaTime sends it base64-encoded as Basic auth)"""
+        scheme, _, credentials = (authorization or "").partition(" ")
+        if scheme.lower() == "basic":
+            try:
+                return base64.b64decode(credentials).decode().split(":", 1)[0]
+            except ValueError:
+                return ""
+        if scheme.lower() == "bearer":
+            return credentials.strip()
+        return ""
+    
+    def accept(self, heartbeats, api_key):
+        """Queue valid, unseen heartbeats to be synced under api_key; returns a (data, status) pair for each"""
+        results = []
+        fresh = []
+        duplicates = 0
+        latest = 0
+        self.offline_manager.remember_key(api_key)  # also lets heartbeats left from an earlier run sync
+        with self.pending_lock:
+            for heartbeat in heartbeats:
+                if not isinstance(heartbeat, dict) or not heartbeat.get("entity") or not isinstance(heartbeat.get("time"), (int, float)):
+                    results.append(({"error": "A heartbeat needs an entity and a numeric time"}, 400))
+                    metrics.inc("gateway_heartbeats_total", result="invalid")
+                    continue
+                payload = dict(heartbeat)
+                # Plugins retry timed-out requests and several may report the same file; send each heartbeat once
+                identity = (payload["entity"], payload.get("project"), payload.get("language"),
+                            payload.get("type"), payload.get("is_write"), payload["time"])
+                results.append(({"data": heartbeat}, 201))
+                if identity in self.seen:
+                    duplicates += 1
+                    continue
+                self.seen[identity] = True
+                if len(self.seen) > GATEWAY_DEDUP_SIZE:
+                    self.seen.popitem(last=False)
+                fresh.append(payload)
+                latest = max(latest, payload["time"])
+        # On disk before the plugin hears back: once acknowledged, a plugin forgets its heartbeats
+        for payload in fresh:
+            self.offline_manager.save_heartbeat_offline(payload, owner_key=api_key)
+            if self.ledger:
+                self.ledger.record_heartbeat(payload.get("project"), payload["time"], sent=False)
+        if fresh:
+            self.offline_manager.flush()
+        with self.pending_lock:
+            self.pending += len(fresh)
+            pending = self.pending
+        metrics.inc("gateway_heartbeats_total", len(fresh), result="accepted")
+        metrics.inc("gateway_heartbeats_total", duplicates, result="duplicate")
+        if pending >= self.batch_size:
+            self.flush_event.set()
+        # A plugin flushing its own offline backlog is not the user being active
+        if self.on_activity and latest > time.time() - HEARTBEAT_COALESCE_SECONDS:
+            self.on_activity()
+        return results
+    
+    def _forward_loop(self):
+        while not self.closed:
+            self.flush_event.wait(self.batch_interval)
+            self.flush_event.clear()
+            self.forward()
+    
+    def forward(self):
+        """Start a sync for the heartbeats queued since the last call; returns how many there were"""
+        with self.pending_lock:
+            pending, self.pending = self.pending, 0
+        if pending:
+            log.debug("gateway.queued", count=pending)
+            if self.on_queued:
+                self.on_queued()
+        return pending
+    
+    def stop(self):
+        """Stop accepting heartbeats and start a sync for any not yet handed on"""
+        self.closed = True
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.flush_event.set()
+        if self.forwarder is not None:
+            self.forwarder.join(timeout=REQUEST_TIMEOUT + 5)
+        self.forward()
+
+class HeadlessLogger:
+    """Logs time for one or more projects without any UI: sessions, heartbeat scheduler and background sync"""
+    def __init__(self, projects, language, api_key, interval=HEARTBEAT_INTERVAL, gateway_port=None, idle_threshold=None):
+        self.projects = [projects] if isinstance(projects, str) else list(projects or ())
+        self.language = language
+        self.api_key = api_key
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.offline_manager = OfflineHeartbeatManager()
+        # No event loop to hand results back to; sync progress goes to the log from the worker thread
+        self.sync_worker = SyncWorker(self.offline_manager, dispatch=lambda callback: callback())
+        self.sync_worker.api_key = api_key
+        metrics.gauge_callback("offline_queue_depth", self.offline_manager.depth)
+        self.ledger = TimeLedger()
+        self.offline_manager.ledger = self.ledger
+        self.scheduler = HeartbeatScheduler(
+            self.offline_manager, on_recovered=lambda api_key: self.sync_worker.wake(catch_up=True),
+            ledger=self.ledger
+        )
+        self.sync_worker.scheduler = self.scheduler
+        self.sessions = SessionManager(self.scheduler, self.ledger)
+        self.gateway = None
+        if gateway_port is not None:
+            self.gateway = HeartbeatGateway(self.offline_manager, self.ledger, port=gateway_port)
+            self.gateway.on_queued = lambda: self.sync_worker.wake(catch_up=True)
+        self.next_beat = 0
+        self.idle_monitor = None
+        source = system_idle_source() if idle_threshold else None
+        if idle_threshold and source is None and not self.gateway:
+            # No window to watch either: once paused, nothing could ever resume it
+            log.warning("idle.unavailable", reason="no system idle source and no gateway")
+        elif idle_threshold:
+            # No window to watch: system-wide input and editor heartbeats are the activity signals
+            self.idle_monitor = IdleMonitor(
+                idle_threshold, [source], on_idle=lambda idle_for: self.sessions.pause(idle_for),
+                on_active=self.on_active, dispatch=lambda callback: callback()
+            )
+            if self.gateway:
+                self.gateway.on_activity = self.idle_monitor.note_activity
+    
+    def run(self, duration=None):
+        """Send heartbeats until stop() is called or duration seconds have elapsed; returns elapsed seconds"""
+        log.info("headless.started", projects=self.projects, language=self.language, interval=self.interval)
+        sessions = [self.sessions.start(project, self.language) for project in self.projects]
+        if sessions:
+            clock = sessions[0].timer
+        else:
+            # Only forwarding the gateway's heartbeats; still honour --duration
+            clock = TimerEngine()
+            clock.start()
+        if self.gateway:
+            self.gateway.start()
+        self.sync_worker.start()
+        # Anything left over from an earlier run goes out straight away
+        self.sync_worker.wake()
+        try:
+            while not self.stop_event.is_set():
+                if self.idle_monitor:
+                    self.idle_monitor.poll()
+                if time.monotonic() >= self.next_beat:
+                    self.beat()
+                    self.next_beat = time.monotonic() + self.interval
+                elapsed = clock.elapsed()
+                if duration is not None and elapsed >= duration:
+                    break
+                wait = max(self.next_beat - time.monotonic(), 0)
+                if duration is not None:
+                    wait = min(wait, duration - elapsed)
+                if self.idle_monitor:
+                    # Polled more often than the heartbeat so a return from idle is noticed quickly
+                    wait = min(wait, IDLE_POLL_SECONDS)
+                self.stop_event.wait(wait)
+        finally:
+            # Close the sessions with one heartbeat each so coalescing never drops their tails
+            self.beat(coalesce=False)
+            if self.gateway:
+                self.gateway.stop()
+            self.sync_worker.stop()
+            self.offline_manager.close()
+            elapsed = max(self.sessions.stop(session) for session in sessions) if sessions else clock.stop()
+        today = self.ledger.today()
+        log.info("headless.stopped", minutes=int(elapsed) // 60, seconds=int(elapsed) % 60,
+                 today_confirmed=round(today["confirmed"]), today_pending=round(today["pending"]))
+        return elapsed
+    
+    def on_active(self):
+        self.sessions.resume()
+        self.next_beat = 0  # back at work: heartbeat on the next loop pass, not a full interval later
+    
+    def beat(self, coalesce=True):
+        for session, status in self.sessions.tick(self.api_key, coalesce=coalesce):
+            if status:
+                log.info("headless.heartbeat", project=session.project, status=status)
+    
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,982 @@
+from kivy.app import App
+from kivy.uix.label import Label
+from kivy.uix.button import Button
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.textinput import TextInput
+from kivy.uix.spinner import Spinner
+from kivy.uix.image import Image
+from kivy.clock import Clock
+from kivy.uix.screenmanager import ScreenManager, Screen
+from datetime import datetime
+from kivy.uix.popup import Popup
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.properties import StringProperty
+from timer_core import (
+    ACCEPTED_STATUSES, SYNC_MAX_DEFAULT, TIMER_RENDER_INTERVAL, HEARTBEAT_INTERVAL, IDLE_POLL_SECONDS,
+    APPS_CACHE_TTL, PROJECTS_CACHE_TTL, OfflineHeartbeatManager, HeartbeatScheduler, SyncWorker,
+    MetadataCache, ImageCache, SessionManager, TimeLedger, HeartbeatGateway, IdleMonitor, build_heartbeat, api_client, request_executor, startup_profiler,
+    UI_STALL_SECONDS, log, metrics, settings, system_idle_source
+)
+
+class LoginScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.layout = BoxLayout(orientation='vertical', padding=20, spacing=10)
+        self.email_input = TextInput(hint_text="Email address", multiline=False)
+        self.layout.add_widget(self.email_input)
+        self.otp_input = TextInput(hint_text="Enter OTP", multiline=False)
+        self.otp_input.opacity = 0
+        self.otp_input.disabled = True
+        self.layout.add_widget(self.otp_input)
+        self.error_label = Label(text="", color=(1,0,0,1))
+        self.layout.add_widget(self.error_label)
+        self.send_button = Button(text="Send OTP")
+        self.send_button.bind(on_press=self.handle_send_otp)
+        self.layout.add_widget(self.send_button)
+        self.verify_button = Button(text="Verify", opacity=0, disabled=True)
+        self.verify_button.bind(on_press=self.handle_verify_otp)
+        self.layout.add_widget(self.verify_button)
+        self.resend_button = Button(text="Resend OTP", opacity=0, disabled=True)
+        self.resend_button.bind(on_press=self.handle_resend_otp)
+        self.layout.add_widget(self.resend_button)
+        self.add_widget(self.layout)
+
+    def handle_send_otp(self, instance):
+        self.error_label.text = ""
+        email = self.email_input.text.strip().lower()
+        if not email:
+            self.error_label.text = "Please enter your email."
+            return
+        def send():
+            # Not retried: a retry could mail the user a second code
+            response = api_client.post(
+                "sendOtp",
+                json={"email": email},
+                headers={"Content-Type": "application/json"},
+                retries=0
+            )
+            return response.ok, response.json()
+        
+        def on_error(e):
+            self.error_label.text = "Failed to connect to the server."
+        
+        request_executor.submit(send, on_success=self.on_otp_sent, on_error=on_error)
+
+    def on_otp_sent(self, result):
+        ok, data = result
+        if ok:
+            self.error_label.text = ""
+            self.otp_input.opacity = 1
+            self.otp_input.disabled = False
+            self.verify_button.opacity = 1
+            self.verify_button.disabled = False
+            self.send_button.disabled = True
+            self.email_input.disabled = True
+            self.resend_button.opacity = 1
+            self.resend_button.disabled = False
+        else:
+            self.error_label.text = data.get("message", "An error occurred.")
+
+    def handle_verify_otp(self, instance):
+        self.error_label.text = ""
+        email = self.email_input.text.strip().lower()
+        otp = self.otp_input.text.strip()
+        if not otp:
+            self.error_label.text = "Please enter the OTP."
+            return
+        def verify():
+            response = api_client.post(
+                "verifyOtp",
+                json={"email": email, "otp": otp},
+                headers={"Content-Type": "application/json"},
+                retries=0
+            )
+            return response.ok, response.json()
+        
+        def on_error(e):
+            self.error_label.text = "Failed to verify OTP."
+        
+        request_executor.submit(verify, on_success=self.on_otp_verified, on_error=on_error)
+
+    def on_otp_verified(self, result):
+        ok, data = result
+        if ok:
+            token = data.get("token")
+            if token:
+                settings.set("auth_token", token)
+                request_executor.submit(settings.flush)
+                app = App.get_running_app()
+                app.show_screen("main")
+                app.fetch_slack_id_and_load_main()
+            else:
+                self.error_label.text = "No token received."
+        else:
+            self.error_label.text = data.get("message", "Invalid OTP.")
+
+    def handle_resend_otp(self, instance):
+        self.resend_button.disabled = True
+        self.handle_send_otp(instance)
+        Clock.schedule_once(lambda dt: setattr(self.resend_button, 'disabled', False), 30)  # 30 seconds cooldown
+
+class MainScreen(Screen):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.slack_id = None
+        self.profile_picture_url = None
+        self.apps_data = {}
+        self.offline_manager = OfflineHeartbeatManager()
+        self.metadata_cache = MetadataCache()
+        self.image_cache = ImageCache()
+        self.ledger = TimeLedger()
+        self.offline_manager.ledger = self.ledger
+        self.layout = BoxLayout(orientation='vertical', padding=20, spacing=10)
+        
+        # Profile picture section
+        self.profile_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=80)
+        self.profile_picture = Image(size_hint=(None, None), size=(60, 60), pos_hint={'center_x': 0.5, 'center_y': 0.5})
+        self.profile_layout.add_widget(self.profile_picture)
+        self.layout.add_widget(self.profile_layout)
+        
+        # Welcome message
+        self.welcome_label = Label(text="Welcome!", font_size=24, size_hint_y=None, height=40)
+        self.layout.add_widget(self.welcome_label)
+        
+        saved_api_key = settings.get("api_key", "")
+        self.api_key_input = TextInput(hint_text="Hackatime API Key", multiline=False, text=saved_api_key)
+        self.api_key_input.bind(text=self.on_api_key_change)
+        self.layout.add_widget(self.api_key_input)
+        self.language_input = TextInput(hint_text="Language (e.g. JavaScript)", multiline=False,
+                                        text=settings.get("language", ""))
+        self.language_input.bind(text=self.on_selection_changed)
+        self.layout.add_widget(self.language_input)
+        # Restore the last selections straight away, so logging can start before the app list loads
+        last_app = settings.get("app")
+        self.app_spinner = Spinner(text=last_app or "Select an app", values=(last_app,) if last_app else ())
+        self.app_spinner.bind(text=self.on_app_selected)
+        self.layout.add_widget(self.app_spinner)
+        last_project = settings.get("project")
+        self.project_spinner = Spinner(text=last_project or "Select a project",
+                                       values=(last_project,) if last_project else ())
+        self.project_spinner.bind(text=self.on_selection_changed)
+        self.layout.add_widget(self.project_spinner)
+        self.unlogged_label = Label(text="Unlogged Time: --:--:-- hours")
+        self.layout.add_widget(self.unlogged_label)
+        # Local totals from the ledger: available offline, no request needed
+        self.ledger_label = Label(text="", font_size=14, size_hint_y=None, height=24)
+        self.layout.add_widget(self.ledger_label)
+        self.timer_label = Label(text="00:00:00", font_size=48)
+        self.layout.add_widget(self.timer_label)
+        
+        # One row per running session; several projects can be logged at once
+        self.sessions_layout = BoxLayout(orientation='vertical', size_hint_y=None, height=0, spacing=2)
+        self.layout.add_widget(self.sessions_layout)
+        self.session_labels = {}
+        
+        self.timer_input = TextInput(hint_text="Set timer (minutes, optional)", multiline=False, input_filter='int',
+                                     text=settings.get("timer_minutes", ""))
+        self.timer_input.bind(text=lambda instance, value: settings.set("timer_minutes", value.strip()))
+        self.layout.add_widget(self.timer_input)
+        self.timer_set_label = Label(text="", color=(0,0,1,1))
+        self.layout.add_widget(self.timer_set_label)
+        
+        self.start_stop_button = Button(text="Start Logging")
+        self.start_stop_button.bind(on_press=self.toggle_logging)
+        self.layout.add_widget(self.start_stop_button)
+        self.test_heartbeat_button = Button(text="Test Heartbeat")
+        self.test_heartbeat_button.bind(on_press=self.test_heartbeat)
+        self.layout.add_widget(self.test_heartbeat_button)
+        self.heartbeat_status_label = Label(text="", color=(0,1,0,1))
+        self.layout.add_widget(self.heartbeat_status_label)
+        
+        # Offline status label
+        self.offline_status_label = Label(text="", color=(1,0.5,0,1), size_hint_y=None, height=30)
+        self.layout.add_widget(self.offline_status_label)
+        
+        # Background request queue readout
+        self.network_label = Label(text="", font_size=12, color=(0.6,0.6,0.6,1), size_hint_y=None, height=20)
+        self.layout.add_widget(self.network_label)
+        Clock.schedule_interval(self.update_network_readout, 2)
+
+        self.view_unsynced_button = Button(text="View Unsynced Heartbeats")
+        self.view_unsynced_button.bind(on_press=self.show_unsynced_heartbeats)
+        self.layout.add_widget(self.view_unsynced_button)
+        
+        self.diagnostics_button = Button(text="Diagnostics")
+        self.diagnostics_button.bind(on_press=lambda btn: DiagnosticsPopup().open())
+        self.layout.add_widget(self.diagnostics_button)
+        
+        self.logout_button = Button(text="Logout")
+        self.logout_button.bind(on_press=self.logout)
+        self.layout.add_widget(self.logout_button)
+        self.heartbeat_scheduler = HeartbeatScheduler(
+            self.offline_manager, on_recovered=self.catch_up_offline_heartbeats, ledger=self.ledger
+        )
+        self.sessions = SessionManager(self.heartbeat_scheduler, self.ledger)
+        self.finishing = set()  # stopped sessions whose last heartbeat has not gone out yet
+        self.timer_event = None
+        self.heartbeat_event = None
+        self.add_widget(self.layout)
+        
+        self.sync_worker = SyncWorker(self.offline_manager, on_progress=self.on_sync_progress)
+        self.sync_worker.api_key = saved_api_key
+        self.sync_worker.scheduler = self.heartbeat_scheduler
+        self.sync_worker.start()
+        self.gateway = None
+        self.idle_monitor = None
+        self.update_ledger_totals()
+        
+        metrics.gauge_callback("offline_queue_depth", self.offline_manager.depth)
+        metrics.gauge_callback("requests_pending", lambda: request_executor.stats()[0])
+        # An every-frame callback: its dt is the frame time, so long gaps are main-thread stalls
+        Clock.schedule_interval(self.on_frame, 0)
+
+    def set_slack_id(self, slack_id, profile_picture_url=None, full_name=None):
+        # Called again as fresher profile data arrives during startup; only redo what changed
+        slack_id_changed = slack_id != self.slack_id
+        self.slack_id = slack_id
+        log.debug("profile.slack_id", slack_id=slack_id, full_name=full_name)
+        if profile_picture_url and profile_picture_url != self.profile_picture_url:
+            self.profile_picture_url = profile_picture_url
+            request_executor.submit(
+                self.download_profile_picture, profile_picture_url,
+                on_success=self.on_profile_picture_downloaded,
+                on_error=lambda e: log.warning("profile.picture_failed", error=str(e))
+            )
+        
+        # Update welcome message with full name
+        if full_name:
+            self.welcome_label.text = f"Welcome, {full_name}!"
+        else:
+            self.welcome_label.text = "Welcome!"
+            
+        if slack_id_changed:
+            self.fetch_apps()
+
+    def download_profile_picture(self, profile_picture_url):
+        """Fetch the profile picture through the image cache (runs on a request worker)"""
+        return self.image_cache.fetch(profile_picture_url)
+
+    def on_profile_picture_downloaded(self, path):
+        if not path:
+            return
+        from kivy.loader import Loader
+        # Loader decodes the image on its own threads; only the texture upload happens here
+        proxy = Loader.image(path)
+        
+        def on_load(proxy):
+            startup_profiler.mark("avatar shown")
+            self.profile_picture.texture = proxy.image.texture
+        
+        proxy.bind(on_load=on_load)
+        if proxy.loaded:
+            on_load(proxy)
+
+    def fetch_apps(self):
+        if not self.slack_id:
+            self.app_spinner.values = ()
+            self.project_spinner.values = ()
+            return
+        slack_id = self.slack_id
+        cache_key = f"apps:{slack_id}"
+        generation = self.metadata_cache.generation
+        
+        # Stale-while-revalidate: show what we had last time, refresh in the background if it's old
+        cached, fresh = self.metadata_cache.get(cache_key, APPS_CACHE_TTL)
+        if cached is not None:
+            self.on_apps_fetched(cached)
+            if fresh:
+                self.prefetch_projects()
+                return
+        
+        def fetch():
+            response = api_client.get(
+                f"getUnloggedTimeForUser?slackId={slack_id}",
+                headers={"Accept": "application/json"}
+            )
+            data = response.json()
+            self.metadata_cache.put(cache_key, data, generation)
+            return data
+        
+        def on_success(data):
+            if data != cached:
+                self.on_apps_fetched(data)
+            self.prefetch_projects()
+        
+        on_error = self.on_apps_fetch_failed if cached is None else (lambda e: log.warning("apps.refresh_failed", error=str(e)))
+        request_executor.submit(fetch, on_success=on_success, on_error=on_error, tag="apps")
+
+    def on_apps_fetched(self, data):
+        startup_profiler.mark("apps shown")
+        log.debug("apps.fetched", slack_id=self.slack_id, response=data)
+        self.apps_data = data.get("apps", {})
+        app_names = list(self.apps_data.keys())
+        if app_names:
+            self.app_spinner.values = tuple(app_names)
+            # Keep the current selection across a refresh when it still exists
+            selected = self.app_spinner.text if self.app_spinner.text in app_names else app_names[0]
+            if self.app_spinner.text == selected:
+                # Spinner won't fire on_text for an unchanged value
+                self.on_app_selected(self.app_spinner, selected)
+            else:
+                self.app_spinner.text = selected
+        else:
+            self.app_spinner.values = ()
+            self.unlogged_label.text = "Unlogged Time: --:--:-- hours"
+            self.project_spinner.values = ()
+
+    def on_apps_fetch_failed(self, e):
+        log.warning("apps.fetch_failed", error=str(e))
+        self.app_spinner.values = ()
+        self.unlogged_label.text = "Unlogged Time: --:--:-- hours"
+        self.project_spinner.values = ()
+
+    def fetch_projects(self, slack_id, app_name, generation=None):
+        """Fetch and cache the project names for one app (runs on a request worker)"""
+        response = api_client.get(
+            f"getAppUserHackatimeProjects?slackId={slack_id}&appName={app_name}",
+            headers={"Accept": "application/json"}
+        )
+        data = response.json()
+        log.debug("projects.fetched", app=app_name, response=data)
+        projects = data.get("projects", [])
+        project_names = [p["name"] if isinstance(p, dict) and "name" in p else str(p) for p in projects]
+        self.metadata_cache.put(f"projects:{slack_id}:{app_name}", project_names, generation)
+        return project_names
+
+    def prefetch_projects(self):
+        """Warm the project cache for every app in parallel so switching apps is instant"""
+        for app_name in self.apps_data:
+            if app_name == self.app_spinner.text:
+                continue  # on_app_selected is already fetching this one
+            _, fresh = self.metadata_cache.get(f"projects:{self.slack_id}:{app_name}", PROJECTS_CACHE_TTL)
+            if not fresh:
+                request_executor.submit(
+                    self.fetch_projects, self.slack_id, app_name, self.metadata_cache.generation,
+                    on_error=lambda e, app_name=app_name: log.warning("projects.prefetch_failed", app=app_name, error=str(e)),
+                    tag="prefetch"
+                )
+
+    def on_app_selected(self, spinner, app_name):
+        if app_name in self.apps_data:
+            settings.set("app", app_name)
+        app_info = self.apps_data.get(app_name, {})
+        unlogged = app_info.get("unloggedHours", 0)
+        self.unlogged_label.text = f"Unlogged Time: {unlogged} hours"
+        # Results for a previously selected app are stale now
+        request_executor.cancel("projects")
+        # Fetch projects for this app from the API
+        if self.slack_id and app_name:
+            cached, fresh = self.metadata_cache.get(f"projects:{self.slack_id}:{app_name}", PROJECTS_CACHE_TTL)
+            if cached is not None:
+                self.set_projects(cached)
+                if fresh:
+                    return
+            
+            def on_error(e):
+                log.warning("projects.fetch_failed", app=app_name, error=str(e))
+                if cached is None:
+                    self.set_projects([])
+            
+            request_executor.submit(
+                self.fetch_projects, self.slack_id, app_name, self.metadata_cache.generation,
+                on_success=self.set_projects, on_error=on_error, tag="projects"
+            )
+        else:
+            self.set_projects([])
+
+    def set_projects(self, project_names):
+        if project_names:
+            self.project_spinner.values = tuple(project_names)
+            if self.project_spinner.text not in project_names:
+                self.project_spinner.text = project_names[0]
+        else:
+            self.project_spinner.values = ()
+            self.project_spinner.text = "Select a project"
+
+    def selected_session_id(self):
+        return self.project_spinner.text, self.language_input.text.strip() or 'JavaScript'
+
+    def on_selection_changed(self, instance, value):
+        project = self.project_spinner.text
+        if project and project != 'Select a project':
+            settings.update(project=project, language=self.language_input.text.strip())
+        session = self.sessions.get(*self.selected_session_id())
+        self.start_stop_button.text = "Stop Logging" if session else "Start Logging"
+        self.timer_label.text = self.format_elapsed(session.timer.elapsed() if session else 0)
+
+    def toggle_logging(self, instance):
+        session = self.sessions.get(*self.selected_session_id())
+        if session is None:
+            self.start_logging()
+        else:
+            self.stop_logging(session)
+
+    def start_logging(self):
+        project, language = self.selected_session_id()
+        if not project or project == 'Select a project':
+            self.timer_set_label.text = "Select a project to start logging."
+            return
+        timer_text = self.timer_input.text.strip()
+        limit_seconds = int(timer_text) * 60 if timer_text.isdigit() and int(timer_text) > 0 else None
+        self.sessions.start(project, language, self.app_spinner.text, limit_seconds)
+        self.timer_set_label.text = f"Timer set for {timer_text} minutes." if limit_seconds else ""
+        self.start_stop_button.text = "Stop Logging"
+        self.timer_label.text = "00:00:00"
+        if self.timer_event is None:
+            # One render tick and one heartbeat tick drive every running session
+            self.timer_event = Clock.schedule_interval(self.update_timer, TIMER_RENDER_INTERVAL)
+            self.heartbeat_event = Clock.schedule_interval(self.send_heartbeat, HEARTBEAT_INTERVAL)
+        self.refresh_session_rows()
+
+    def stop_logging(self, session):
+        self.finishing.add(session)
+        request_executor.submit(
+            self.finish_session, self.api_key_input.text.strip(), session,
+            on_success=self.on_heartbeats_handled
+        )
+        self.sessions.stop(session)
+        if session.id == self.selected_session_id():
+            self.start_stop_button.text = "Start Logging"
+            self.timer_set_label.text = ""
+        if not self.sessions.running():
+            self.timer_event.cancel()
+            self.timer_event = None
+            self.heartbeat_event.cancel()
+            self.heartbeat_event = None
+        self.refresh_session_rows()
+
+    def finish_session(self, api_key, session):
+        """Send a stopped session's last heartbeat, then make sure anything queued is on disk (runs on a worker)"""
+        # Close the session with one heartbeat so coalescing never drops its tail
+        results = self.sessions.tick(api_key, [session], coalesce=False) if api_key else []
+        self.finishing.discard(session)
+        self.offline_manager.flush(durable=True)
+        return results
+
+    def close_sessions(self):
+        """Stop every session and send the last heartbeats right here, blocking (the app is exiting)"""
+        sessions = self.sessions.running()
+        for session in sessions:
+            self.sessions.stop(session)
+        # Including stopped sessions whose finish_session the closing executor may never run
+        sessions += list(self.finishing)
+        self.finishing.clear()
+        api_key = self.api_key_input.text.strip()
+        if sessions and api_key:
+            try:
+                self.sessions.tick(api_key, sessions, coalesce=False)
+            except Exception as e:
+                log.warning("heartbeat.final_failed", error=str(e))
+
+    def refresh_session_rows(self):
+        self.sessions_layout.clear_widgets()
+        self.session_labels = {}
+        for session in self.sessions.running():
+            row = BoxLayout(orientation='horizontal', size_hint_y=None, height=30, spacing=5)
+            label = Label(text=self.session_text(session))
+            row.add_widget(label)
+            stop_btn = Button(text="Stop", size_hint_x=None, width=80)
+            stop_btn.bind(on_press=lambda btn, session=session: self.stop_logging(session))
+            row.add_widget(stop_btn)
+            self.sessions_layout.add_widget(row)
+            self.session_labels[session.id] = label
+        self.sessions_layout.height = len(self.session_labels) * 32
+
+    def session_text(self, session):
+        text = f"{session.project} ({session.language})  {self.format_elapsed(session.timer.elapsed())}"
+        if self.sessions.paused:
+            return f"{text}  Paused (idle)"
+        return f"{text}  {session.status}" if session.status else text
+
+    @staticmethod
+    def format_elapsed(seconds):
+        seconds = int(seconds)
+        return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+    def update_timer(self, dt):
+        for session in self.sessions.expired():
+            self.timer_set_label.text = f"Timer reached for {session.project}! Stopping logging."
+            self.stop_logging(session)
+        # Derived from each engine on every render, so however late this tick fires the display is exact
+        for session in self.sessions.running():
+            label = self.session_labels.get(session.id)
+            if label is not None:
+                label.text = self.session_text(session)
+        selected = self.sessions.get(*self.selected_session_id())
+        if selected is not None:
+            self.timer_label.text = self.format_elapsed(selected.timer.elapsed())
+
+    def test_heartbeat(self, instance):
+        project = self.project_spinner.text
+        api_key = self.api_key_input.text.strip()
+        language = self.language_input.text.strip() or 'JavaScript'
+        if not project or project == 'Select a project':
+            self.heartbeat_status_label.text = "No project selected."
+            self.heartbeat_status_label.color = (1,0,0,1)
+            log.warning("heartbeat.no_project")
+            return
+        if not api_key:
+            self.heartbeat_status_label.text = "No API key entered."
+            self.heartbeat_status_label.color = (1,0,0,1)
+            log.warning("heartbeat.no_api_key")
+            return
+        payload = build_heartbeat(project, language, api_key)
+        def post():
+            response = api_client.post(
+                "heartbeats",
+                json=payload,
+                headers={"Content-Type": "application/json"}
+            )
+            log.info("heartbeat.test_response", status=response.status_code, body=response.text)
+            return response.status_code
+        
+        def on_success(status_code):
+            if status_code in ACCEPTED_STATUSES:
+                self.heartbeat_status_label.text = "Heartbeat OK!"
+                self.heartbeat_status_label.color = (0,1,0,1)
+            else:
+                self.heartbeat_status_label.text = f"Heartbeat failed: {status_code}"
+                self.heartbeat_status_label.color = (1,0,0,1)
+        
+        def on_error(e):
+            self.heartbeat_status_label.text = "Error sending heartbeat."
+            self.heartbeat_status_label.color = (1,0,0,1)
+            log.warning("heartbeat.test_error", error=str(e))
+        
+        request_executor.submit(post, on_success=on_success, on_error=on_error)
+
+    def send_heartbeat(self, dt, coalesce=True):
+        api_key = self.api_key_input.text.strip()
+        if not self.sessions.running():
+            return
+        if not api_key:
+            log.warning("heartbeat.no_api_key")
+            return
+        # Every session's heartbeat goes out in the same batch
+        request_executor.submit(
+            self.sessions.tick, api_key, None, coalesce,
+            on_success=self.on_heartbeats_handled
+        )
+
+    def on_heartbeats_handled(self, results):
+        statuses = [status for _, status in results if status is not None]
+        if statuses:
+            self.offline_status_label.text = next((status for status in statuses if status), "")
+            self.update_ledger_totals()
+
+    def update_ledger_totals(self):
+        # Off the main thread: the first query also opens (and may create) the ledger database
+        request_executor.submit(
+            lambda: (self.ledger.today(), self.ledger.week()),
+            on_success=self.show_ledger_totals,
+            on_error=lambda e: log.warning("ledger.read_failed", error=str(e))
+        )
+
+    def show_ledger_totals(self, totals):
+        today, week = totals
+        text = f"Today: {self.format_total(today['confirmed'] + today['pending'])}"
+        if today["pending"]:
+            text += f" ({self.format_total(today['pending'])} pending)"
+        self.ledger_label.text = f"{text} | This week: {self.format_total(week['confirmed'] + week['pending'])}"
+
+    @staticmethod
+    def format_total(seconds):
+        minutes = int(seconds) // 60
+        return f"{minutes // 60}h {minutes % 60:02d}m"
+
+    def catch_up_offline_heartbeats(self, api_key):
+        """Drain the offline queue right away once the API answers again (called from a worker)"""
+        if api_key:
+            self.sync_worker.api_key = api_key
+        self.sync_worker.wake(catch_up=True)
+
+    def on_sync_progress(self, text):
+        self.offline_status_label.text = text
+        self.update_ledger_totals()
+
+    def update_network_readout(self, dt):
+        pending, average_ms = request_executor.stats()
+        reuse_ratio = api_client.stats()["reuse_ratio"]
+        self.network_label.text = (
+            f"Requests pending: {pending} | avg latency: {average_ms:.0f} ms | "
+            f"connections reused: {reuse_ratio:.0%}"
+        )
+
+    def on_frame(self, dt):
+        metrics.observe("ui_frame_seconds", dt)
+        if dt > UI_STALL_SECONDS:
+            metrics.inc("ui_frame_stalls_total")
+            log.debug("ui.stall", ms=round(dt * 1000))
+
+    def logout(self, instance):
+        settings.delete("auth_token")
+        # Requests still in flight belong to this user: drop their results and keep them out of the cache
+        for tag in ("apps", "projects", "prefetch", "profile"):
+            request_executor.cancel(tag)
+        self.metadata_cache.invalidate()
+        request_executor.submit(self.offline_manager.flush, True)
+        self.slack_id = None
+        self.profile_picture_url = None
+        self.profile_picture.texture = None
+        App.get_running_app().show_screen("login")
+
+    def start_gateway(self, port):
+        """Accept editor plugins' heartbeats on localhost and send them along with this screen's"""
+        self.gateway = HeartbeatGateway(self.offline_manager, self.ledger, port=port)
+        self.gateway.on_queued = lambda: self.sync_worker.wake(catch_up=True)
+        self.gateway.start()
+        if self.idle_monitor:
+            self.gateway.on_activity = self.idle_monitor.note_activity
+    
+    def enable_idle_detection(self, threshold):
+        """Pause timers and heartbeats after threshold seconds without input, resuming on the next input"""
+        from kivy.core.window import Window
+        self.idle_monitor = IdleMonitor(
+            threshold, [system_idle_source()], on_idle=self.on_idle, on_active=self.on_active
+        )
+        note = lambda *args: self.idle_monitor.note_activity()
+        Window.bind(mouse_pos=note, on_touch_down=note, on_key_down=note, on_restore=note)
+        if self.gateway:
+            self.gateway.on_activity = self.idle_monitor.note_activity
+        # The system source may spawn a process; keep it off the main thread
+        Clock.schedule_interval(lambda dt: request_executor.submit(self.idle_monitor.poll), IDLE_POLL_SECONDS)
+    
+    def on_idle(self, idle_for):
+        self.sessions.pause(idle_for)
+        if self.sessions.running():
+            self.offline_status_label.text = f"Paused: idle for {int(idle_for) // 60} min"
+        self.update_timer(0)
+    
+    def on_active(self):
+        self.sessions.resume()
+        if self.sessions.running():
+            self.offline_status_label.text = ""
+            self.send_heartbeat(0)
+    
+    def on_api_key_change(self, instance, value):
+        self.sync_worker.api_key = value.strip()
+        # Debounced: typing or pasting a key ends up as one write
+        settings.set("api_key", value.strip())
+
+    def show_unsynced_heartbeats(self, instance):
+        popup = UnsyncedHeartbeatsPopup(
+            self.offline_manager,
+            on_delete=self.delete_unsynced_heartbeat,
+            on_delete_all=self.delete_all_unsynced_heartbeats
+        )
+        self._unsynced_popup = popup
+        popup.open()
+
+    def delete_unsynced_heartbeat(self, key):
+        self.offline_manager.remove_heartbeat(key)
+        if hasattr(self, '_unsynced_popup'):
+            self._unsynced_popup.remove_row(key)
+        self.update_ledger_totals()
+
+    def delete_all_unsynced_heartbeats(self):
+        popup = getattr(self, '_unsynced_popup', None)
+        # Honour whatever filter the viewer is showing; with none this empties the queue
+        self.offline_manager.delete_heartbeats(**(popup.filters if popup else {}))
+        if popup:
+            popup.load_page()
+        self.update_ledger_totals()
+
+class UnsyncedHeartbeatRow(RecycleDataViewBehavior, BoxLayout):
+    """Recycled row of the unsynced heartbeats list"""
+    key = StringProperty("")
+    text = StringProperty("")
+    
+    def __init__(self, **kwargs):
+        super().__init__(orientation='horizontal', **kwargs)
+        self.delete_callback = None
+        self.label = Label()
+        self.bind(text=self.label.setter('text'))
+        self.add_widget(self.label)
+        del_btn = Button(text="Delete", size_hint_x=None, width=80)
+        del_btn.bind(on_press=lambda btn: self.delete_callback and self.delete_callback(self.key))
+        self.add_widget(del_btn)
+
+class UnsyncedHeartbeatsPopup(Popup):
+    """Paged, filterable view of the offline queue; only the visible rows exist as widgets"""
+    def __init__(self, offline_manager, on_delete, on_delete_all, **kwargs):
+        super().__init__(title="Unsynced Heartbeats", size_hint=(0.9, 0.8), **kwargs)
+        self.offline_manager = offline_manager
+        self.on_delete = on_delete
+        self.page_size = SYNC_MAX_DEFAULT
+        self.offset = 0
+        self.page_cursors = [None]  # queue cursor at the start of each page visited so far
+        self.page_offsets = [0]  # and that page's position in the list, for "Showing X-Y"
+        self.next_cursor = None
+        self.filters = {}
+        self.total = 0
+        
+        content = BoxLayout(orientation='vertical', spacing=5)
+        
+        filter_row = BoxLayout(orientation='horizontal', size_hint_y=None, height=40, spacing=5)
+        self.project_filter = Spinner(text="All projects", values=("All projects",) + tuple(offline_manager.list_projects()))
+        filter_row.add_widget(self.project_filter)
+        self.since_input = TextInput(hint_text="From (YYYY-MM-DD)", multiline=False)
+        filter_row.add_widget(self.since_input)
+        self.until_input = TextInput(hint_text="To (YYYY-MM-DD)", multiline=False)
+        filter_row.add_widget(self.until_input)
+        apply_btn = Button(text="Filter", size_hint_x=None, width=80)
+        apply_btn.bind(on_press=lambda btn: self.apply_filters())
+        filter_row.add_widget(apply_btn)
+        content.add_widget(filter_row)
+        
+        self.summary_label = Label(text="", size_hint_y=None, height=30)
+        content.add_widget(self.summary_label)
+        
+        self.rv = RecycleView(size_hint=(1, 1))
+        self.rv.viewclass = UnsyncedHeartbeatRow
+        rv_layout = RecycleBoxLayout(
+            orientation='vertical', default_size=(None, 30), default_size_hint=(1, None), size_hint_y=None
+        )
+        rv_layout.bind(minimum_height=rv_layout.setter('height'))
+        self.rv.add_widget(rv_layout)
+        content.add_widget(self.rv)
+        
+        page_row = BoxLayout(orientation='horizontal', size_hint_y=None, height=40, spacing=5)
+        self.prev_btn = Button(text="< Previous")
+        self.prev_btn.bind(on_press=lambda btn: self.change_page(-1))
+        page_row.add_widget(self.prev_btn)
+        self.next_btn = Button(text="Next >")
+        self.next_btn.bind(on_press=lambda btn: self.change_page(1))
+        page_row.add_widget(self.next_btn)
+        content.add_widget(page_row)
+        
+        self.del_all_btn = Button(text="Delete All Unsynced Heartbeats", size_hint_y=None, height=40)
+        self.del_all_btn.bind(on_press=lambda btn: on_delete_all())
+        content.add_widget(self.del_all_btn)
+        close_btn = Button(text="Close", size_hint_y=None, height=40)
+        close_btn.bind(on_press=self.dismiss)
+        content.add_widget(close_btn)
+        self.content = content
+        self.load_page()
+    
+    def apply_filters(self):
+        filters = {}
+        if self.project_filter.text != "All projects":
+            filters["project"] = self.project_filter.text
+        try:
+            if self.since_input.text.strip():
+                filters["since"] = datetime.strptime(self.since_input.text.strip(), "%Y-%m-%d").timestamp()
+            if self.until_input.text.strip():
+                # Inclusive of the whole "to" day
+                filters["until"] = datetime.strptime(self.until_input.text.strip(), "%Y-%m-%d").timestamp() + 86400
+        except ValueError:
+            self.summary_label.text = "Dates must look like 2025-06-30."
+            return
+        self.filters = filters
+        self.offset = 0
+        self.page_cursors = [None]
+        self.page_offsets = [0]
+        self.del_all_btn.text = "Delete All Matching Heartbeats" if filters else "Delete All Unsynced Heartbeats"
+        self.load_page()
+    
+    def change_page(self, direction):
+        # Pages shrink as rows are deleted, so going back restores the recorded offset
+        # rather than subtracting a full page
+        if direction > 0:
+            self.page_cursors.append(self.next_cursor)
+            self.page_offsets.append(self.offset + len(self.rv.data))
+        elif len(self.page_cursors) > 1:
+            self.page_cursors.pop()
+            self.page_offsets.pop()
+        self.offset = self.page_offsets[-1]
+        self.load_page()
+    
+    def load_page(self):
+        self.total = self.offline_manager.count_offline_heartbeats(**self.filters)
+        heartbeats, self.next_cursor = self.offline_manager.read_heartbeats(
+            after=self.page_cursors[-1], limit=self.page_size, **self.filters
+        )
+        if not heartbeats and len(self.page_cursors) > 1:
+            # Everything on this page was synced or deleted meanwhile; show the one before it
+            self.change_page(-1)
+            return
+        self.rv.data = [self.row_data(record) for record in heartbeats]
+        self.update_summary()
+    
+    def row_data(self, record):
+        desc = f"{record.project or '(no project)'} @ {datetime.fromtimestamp(record.time).strftime('%Y-%m-%d %H:%M:%S')}"
+        return {"key": record.key, "text": desc, "delete_callback": self.on_delete}
+    
+    def update_summary(self):
+        if not self.total:
+            self.summary_label.text = "No unsynced heartbeats!"
+        else:
+            first = self.offset + 1
+            last = self.offset + len(self.rv.data)
+            self.summary_label.text = f"Showing {first}-{last} of {self.total}"
+        self.prev_btn.disabled = self.offset == 0
+        self.next_btn.disabled = self.offset + len(self.rv.data) >= self.total
+        self.del_all_btn.disabled = not self.total
+    
+    def remove_row(self, key):
+        """Drop one row from the in-memory model without reloading the page"""
+        self.rv.data = [row for row in self.rv.data if row["key"] != key]
+        self.total = max(0, self.total - 1)
+        self.update_summary()
+
+class DiagnosticsPopup(Popup):
+    """Live view of the in-process metrics, refreshed while open"""
+    def __init__(self, **kwargs):
+        super().__init__(title="Diagnostics", size_hint=(0.9, 0.8), **kwargs)
+        content = BoxLayout(orientation='vertical', spacing=5)
+        self.metrics_label = Label(text="", halign='left', valign='top', font_size=13)
+        self.metrics_label.bind(size=lambda label, size: setattr(label, 'text_size', size))
+        content.add_widget(self.metrics_label)
+        close_btn = Button(text="Close", size_hint_y=None, height=40)
+        close_btn.bind(on_press=lambda btn: self.dismiss())
+        content.add_widget(close_btn)
+        self.content = content
+        self.refresh(0)
+        self.refresh_event = Clock.schedule_interval(self.refresh, 1)
+        self.bind(on_dismiss=lambda popup: self.refresh_event.cancel())
+    
+    def refresh(self, dt):
+        data = metrics.to_json()
+        lines = [f"{name}: {value}" for name, value in sorted(data["counters"].items())]
+        lines += [f"{name}: {value:.4g}" for name, value in sorted(data["gauges"].items())]
+        for name, histogram in sorted(data["histograms"].items()):
+            if histogram["count"]:
+                average_ms = histogram["sum"] / histogram["count"] * 1000
+                lines.append(f"{name}: avg {average_ms:.1f} ms over {histogram['count']}")
+        self.metrics_label.text = "\n".join(lines) or "No metrics recorded yet."
+
+class HackatimeTimerApp(App):
+    gateway_port = None  # set by main.py from --gateway-port
+    idle_threshold = None  # and --idle-minutes, in seconds
+    
+    def get_application_name(self):
+        return "hackatime timer"
+    
+    def build(self):
+        self.sm = ScreenManager()
+        self.login_screen = None
+        self.main_screen = None
+        # Auto-login if token exists; only the screen being shown is built now
+        if settings.get("auth_token"):
+            self.show_screen("main")
+            self.fetch_slack_id_and_load_main()
+        else:
+            self.show_screen("login")
+        startup_profiler.mark("build")
+        Clock.schedule_once(lambda dt: startup_profiler.mark("first frame"))
+        return self.sm
+
+    def show_screen(self, name):
+        """Switch to a screen, constructing it the first time it is needed"""
+        if name == "main" and self.main_screen is None:
+            self.main_screen = MainScreen(name="main")
+            self.sm.add_widget(self.main_screen)
+            if self.idle_threshold:
+                self.main_screen.enable_idle_detection(self.idle_threshold)
+            if self.gateway_port is not None:
+                self.main_screen.start_gateway(self.gateway_port)
+        elif name == "login" and self.login_screen is None:
+            self.login_screen = LoginScreen(name="login")
+            self.sm.add_widget(self.login_screen)
+        self.sm.current = name
+
+    def fetch_slack_id_and_load_main(self):
+        token = settings.get("auth_token")
+        if not token:
+            return
+        # Render straight away from the last known profile; everything below only revalidates it
+        self.cached_profile, _ = self.main_screen.metadata_cache.get("profile", 0)
+        if self.cached_profile:
+            self.show_profile(self.cached_profile)
+            startup_profiler.mark("cached profile shown")
+            # The slack id is already known, so neighbor details needn't wait for getMyPfp
+            self.request_neighbor_details(self.cached_profile["slack_id"], self.cached_profile.get("pfp_url"))
+        request_executor.submit(
+            self.fetch_profile, token,
+            on_success=self.on_my_pfp_fetched,
+            on_error=lambda e: log.warning("profile.fetch_failed", error=str(e)),
+            tag="profile"
+        )
+
+    def fetch_profile(self, token):
+        """Resolve slack id and profile picture URL for a token (runs on a request worker)"""
+        response = api_client.get(
+            f"getMyPfp?token={token}",
+            headers={"Accept": "application/json"}
+        )
+        data = response.json()
+        slack_id = data.get("slackId")
+        if isinstance(slack_id, list):
+            slack_id = slack_id[0] if slack_id else None
+        
+        # Extract profile picture URL
+        profile_picture_url = None
+        pfp_data = data.get("pfp", [])
+        if pfp_data and len(pfp_data) > 0:
+            profile_picture_url = pfp_data[0].get("url")
+        
+        return slack_id, profile_picture_url
+
+    def on_my_pfp_fetched(self, result):
+        startup_profiler.mark("getMyPfp")
+        slack_id, profile_picture_url = result
+        if not slack_id:
+            return
+        if self.cached_profile and self.cached_profile["slack_id"] == slack_id:
+            return  # neighbor details for this slack id are already on their way
+        # Start the app list and avatar now, in parallel with the neighbor lookup for the name
+        self.main_screen.set_slack_id(slack_id, profile_picture_url)
+        self.request_neighbor_details(slack_id, profile_picture_url)
+
+    def request_neighbor_details(self, slack_id, profile_picture_url):
+        request_executor.submit(
+            self.fetch_neighbor_details, slack_id, profile_picture_url,
+            on_success=self.on_profile_fetched, tag="profile"
+        )
+
+    def fetch_neighbor_details(self, slack_id, profile_picture_url):
+        try:
+            response = api_client.get(
+                f"getNeighborDetails?slackId={slack_id}",
+                headers={"Accept": "application/json"}
+            )
+            data = response.json()
+            log.debug("profile.neighbor_details", slack_id=slack_id, status=response.status_code, response=data)
+            
+            # Extract full_name and pfp from the nested neighbor object
+            neighbor_data = data.get("neighbor", {})
+            full_name = neighbor_data.get("fullName")
+            profile_picture_url = neighbor_data.get("pfp")  # Get pfp from neighbor
+            
+            return slack_id, profile_picture_url, full_name
+        except Exception as e:
+            log.warning("profile.neighbor_details_failed", slack_id=slack_id, error=str(e))
+            # Fallback to setting without full name or pfp
+            return slack_id, profile_picture_url, None
+
+    def on_profile_fetched(self, profile):
+        startup_profiler.mark("neighbor details")
+        slack_id, profile_picture_url, full_name = profile
+        cached = self.cached_profile or {}
+        if full_name is None and cached.get("slack_id") == slack_id:
+            full_name = cached.get("full_name")  # lookup failed, keep the name we had
+        self.cached_profile = {"slack_id": slack_id, "pfp_url": profile_picture_url, "full_name": full_name}
+        self.main_screen.metadata_cache.put("profile", self.cached_profile)
+        self.show_profile(self.cached_profile)
+
+    def show_profile(self, profile):
+        self.main_screen.set_slack_id(profile["slack_id"], profile.get("pfp_url"), profile.get("full_name"))
+
+    def on_stop(self):
+        if self.main_screen is not None:
+            self.main_screen.close_sessions()
+        request_executor.shutdown()
+        if self.main_screen is not None:
+            if self.main_screen.gateway:
+                self.main_screen.gateway.stop()
+            self.main_screen.sync_worker.stop()
+            self.main_screen.offline_manager.close()
+        settings.close()
+        api_client.close()